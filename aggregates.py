@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+MEASURES = ['gross income', 'Total', 'Quantity', 'Rating']
+# Sums of squares alongside the sums, so group variances (and confidence intervals) merge like everything else
+SQUARES = {measure: f'{measure} squared' for measure in MEASURES}
+
+GROUPINGS = [
+    ('Product line',),
+    ('Branch',),
+    ('Gender',),
+    ('Month',),
+    ('Month', 'Product line'),
+    ('Product line', 'Gender'),
+]
+
+
+def month_of(dataset):
+    if 'Month' in dataset.columns:
+        return dataset['Month']
+    return pd.to_datetime(dataset['Date']).dt.to_period('M').rename('Month')
+
+
+class AggregateCube:
+    # Per grouping key, one row per group holding the sum and sum of squares of every measure plus the row count
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    @staticmethod
+    def _keys(keys):
+        return (keys,) if isinstance(keys, str) else tuple(keys)
+
+    def table(self, keys):
+        return self.tables[self._keys(keys)]
+
+    def sum(self, keys, measure):
+        return self.table(keys)[measure]
+
+    def count(self, keys):
+        return self.table(keys)['count']
+
+    def mean(self, keys, measure):
+        table = self.table(keys)
+        return (table[measure] / table['count']).rename(measure)
+
+    def std(self, keys, measure):
+        # Sample standard deviation; undefined for groups of a single row
+        table = self.table(keys)
+        count = table['count'].where(table['count'] > 1)
+        variance = (table[SQUARES[measure]] - table[measure].astype(float) ** 2 / count) / (count - 1)
+        return np.sqrt(variance.clip(lower=0)).rename(measure)
+
+    def confidence(self, keys, measure, z=1.96):
+        # Half-width of the normal-approximation interval around each group mean, 95% by default: what
+        # seaborn's bootstrap converges to, without resampling the rows
+        return (z * self.std(keys, measure) / np.sqrt(self.count(keys))).rename(measure)
+
+    def merge(self, other):
+        # Sums and counts are additive, so a cube of new rows folds in without revisiting old ones
+        tables = {}
+        for keys, table in self.tables.items():
+            new = other.tables[keys]
+            by = []
+            for level in range(table.index.nlevels):
+                old_keys, new_keys = table.index.get_level_values(level), new.index.get_level_values(level)
+                stacked_keys = old_keys.append(new_keys)
+                if isinstance(old_keys.dtype, pd.CategoricalDtype):
+                    # Keep the labels categorical, with the categories of both sides, like a cube built from scratch
+                    categories = old_keys.dtype.categories.union(new_keys.dtype.categories)
+                    stacked_keys = stacked_keys.astype(pd.CategoricalDtype(categories))
+                by.append(stacked_keys)
+            stacked = pd.concat([table, new], ignore_index=True)
+            tables[keys] = stacked.groupby(by, observed=True).sum()
+        return AggregateCube(tables)
+
+
+def build_cube(dataset, groupings=GROUPINGS):
+    month = month_of(dataset) if any('Month' in keys for keys in groupings) else None
+    tables = {}
+    for keys in groupings:
+        by = [month if key == 'Month' else dataset[key] for key in keys]
+        values = dataset[MEASURES]
+        squares = (values.astype(float) ** 2).rename(columns=SQUARES)
+        grouped = pd.concat([values, squares], axis=1).groupby(by, observed=True)
+        table = grouped.sum()
+        table['count'] = grouped.size()
+        tables[keys] = table
+    return AggregateCube(tables)
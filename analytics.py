@@ -0,0 +1,78 @@
+import importlib.util
+import io
+
+import pandas as pd
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+HAS_ARROW = importlib.util.find_spec('pyarrow') is not None
+
+# Visualization type -> cube grouping and the series the chart plots, as (column, statistic, measure)
+SERIES = {
+    'product_distribution': (('Product line',), [('count', 'count', None)]),
+    'profitability': (('Product line',), [('gross income', 'sum', 'gross income')]),
+    'revenue': (('Product line',), [('Total', 'sum', 'Total')]),
+    'sales_volume': (('Product line',), [('Quantity', 'sum', 'Quantity')]),
+    'sales_volume_by_gender': (('Product line', 'Gender'), [('mean Quantity', 'mean', 'Quantity'),
+                                                             ('count', 'count', None)]),
+    'monthly_income': (('Month', 'Product line'), [('gross income', 'sum', 'gross income')]),
+    # Mirrors the chart, which plots mean Quantity under its gross income title
+    'gross_income_by_gender': (('Product line', 'Gender'), [('mean Quantity', 'mean', 'Quantity'),
+                                                             ('count', 'count', None)]),
+    'monthly_gross_income': (('Month',), [('gross income', 'sum', 'gross income')]),
+    'total_gross_income_by_branch': (('Branch',), [('gross income', 'sum', 'gross income')]),
+    'average_ratings_by_product_lines': (('Product line',), [('mean Rating', 'mean', 'Rating')]),
+    'product_lines_gross_income': (('Product line',), [('gross income', 'sum', 'gross income')]),
+    'average_ratings_vs_sales_volume': (('Product line',), [('mean Rating', 'mean', 'Rating'),
+                                                            ('Quantity', 'sum', 'Quantity')]),
+}
+
+
+def aggregate_frame(visualization_type, source):
+    # The series behind a chart as a flat table, read from the cube or the correlation moments of source: the
+    # data context, or a filtered view of it
+    if visualization_type == 'cogs_and_gross_income':
+        return regression_frame(source.correlations)
+    if visualization_type == 'correlation_heatmap':
+        return source.correlations.frame().rename_axis('column').reset_index()
+    return series_frame(visualization_type, source.cube)
+
+
+def series_frame(visualization_type, cube):
+    keys, series = SERIES[visualization_type]
+    columns = {}
+    for column, statistic, measure in series:
+        if statistic == 'count':
+            columns[column] = cube.count(keys)
+        else:
+            columns[column] = getattr(cube, statistic)(keys, measure)
+    frame = pd.DataFrame(columns).reset_index()
+    if 'Month' in frame.columns:
+        frame['Month'] = frame['Month'].astype(str)
+    return frame
+
+
+def regression_frame(correlations, x='cogs', y='gross income'):
+    # Least-squares fit of y on x over every row, read from the correlation moments rather than the rows
+    moments = correlations.moments()
+    i, j = correlations.columns.index(x), correlations.columns.index(y)
+    sxx, sxy = moments.scatter[i, i], moments.scatter[i, j]
+    slope = sxy / sxx if sxx > 0 else float('nan')
+    return pd.DataFrame([{'rows': moments.count, f'mean {x}': moments.mean[i], f'mean {y}': moments.mean[j],
+                          'slope': slope, 'intercept': moments.mean[j] - slope * moments.mean[i],
+                          'correlation': moments.correlation[i, j]}])
+
+
+def records(frame):
+    # JSON has no NaN, e.g. the correlation of the constant gross margin column, so send null
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient='records')
+
+
+def arrow_stream(frame, compression='zstd'):
+    # Arrow IPC stream with compressed record batch buffers; clients get typed columns without parsing
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
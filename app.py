@@ -1,735 +1,724 @@
-from flask import Flask, render_template, request
-import pandas as pd
-import seaborn as sns
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error
-import matplotlib.pyplot as plt
+from flask import (Flask, render_template, request, jsonify, Response, stream_with_context, abort, url_for,
+                   stream_template)
 import io
-import base64
-
+import os
+import functools
+import json
+import hashlib
+import tempfile
+import time
+from collections import namedtuple
+
+import instrumentation
+from compression import MIN_SIZE, CompressedCache, compress, compress_stream, compressible, negotiate
+from context import FiltersUnavailable, InvalidFilters, data
+from ingest import BatchDirectory, read_batch
+from plot_cache import PlotCache
+from render_jobs import RenderJobs
+from render_pool import RenderPool, RenderQueueFull
+
+# pandas, matplotlib, seaborn and scikit-learn are imported by the modules that need them, on first use,
+# and the dataset, cube and sales model are built lazily by the shared data context
 app = Flask(__name__)
 
-# Load the dataset
-dataset = pd.read_csv("supermarket_sales.csv")
-
-# Convert dataset to HTML table format
-dataset_html = dataset.to_html(index=False)
-
-
-def generate_visualization(visualization_type):
-    if visualization_type == 'product_distribution':
-        return generate_product_distribution_plot()
-    elif visualization_type == 'profitability':
-        return generate_profitability_plot()
-    elif visualization_type == 'revenue':
-        return generate_revenue_plot()
-    elif visualization_type == 'sales_volume':
-        return generate_sales_volume_plot()
-    elif visualization_type == 'sales_volume_by_gender':
-        return sales_volume_segmented_by_gender_plot()
-    elif visualization_type == 'monthly_income':
-        return generate_monthly_income_plot()
-    elif visualization_type == 'gross_income_by_gender':
-        return generate_gross_income_by_gender_plot()
-    elif visualization_type == 'monthly_gross_income':
-        return generate_monthly_gross_income_plot()
-    elif visualization_type == 'total_gross_income_by_branch':
-        return generate_total_gross_income_by_branch_plot()
-    elif visualization_type == 'average_ratings_by_product_lines':
-        return average_ratings_by_product_lines()
-    elif visualization_type == 'product_lines_gross_income':
-        return product_lines_gross_income()
-    elif visualization_type == 'average_ratings_vs_sales_volume':
-        return average_ratings_vs_sales_volume()
-    elif visualization_type == 'cogs_and_gross_income':
-        return cogs_gross_income()
-    elif visualization_type == 'correlation_heatmap':
-        return correlation_heatmap()
-    else:
-        return None, None
-
-
-def correlation_heatmap():
-    numeric_columns = dataset.select_dtypes(include=['float64', 'int64']).columns
-    numeric_data = dataset[numeric_columns]
-    plt.figure(figsize=(10, 8))
-    sns.heatmap(numeric_data.corr(), annot=True, cmap='coolwarm')
-    plt.title('Correlation Heatmap')
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-    <p>The provided dataset contains information on unit price, quantity sold, gross income, and rating for various 
-    products. Let's explore some insights:</p>
-
-    <ul>
-      <li><strong>Correlation between Unit Price and Gross Income:</strong></li>
-      <p>Higher unit prices may lead to higher gross income if the quantity sold remains constant. Analyzing this 
-      relationship can help identify pricing strategies to maximize revenue.</p>
-      
-      <li><strong>Impact of Quantity Sold on Gross Income:</strong></li>
-      <p>The quantity sold directly affects gross income. Understanding how changes in quantity impact income can inform
-       inventory management and sales forecasting.</p>
-      
-      <li><strong>Relationship between Rating and Gross Income:</strong></li>
-      <p>Products with higher ratings may attract more customers and result in higher gross income. Evaluating this 
-      correlation can guide product development and marketing efforts to enhance customer satisfaction and revenue.</p>
-    </ul>
-    
-    <p>By analyzing these relationships, businesses can make informed decisions to optimize pricing strategies, manage 
-    inventory effectively, and enhance product quality to drive overall profitability.</p>
-
-                    '''
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Correlation Heatmap">', explanation
-
-
-def cogs_gross_income():
-    sns.jointplot(x='cogs', y='gross income', data=dataset, kind='reg')
-    plt.xlabel('Cost of Goods Sold (COGS)')
-    plt.ylabel('Gross Income')
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-    .
-                '''
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Cost of Goods Sold and Gross income">', explanation
-
-
-def average_ratings_vs_sales_volume():
-    avg_rating = dataset.groupby('Product line')['Rating'].mean()
-    sales_volume = dataset.groupby('Product line')['Quantity'].sum()
-
-    plt.figure(figsize=(10, 6))
-    plt.scatter(avg_rating, sales_volume, c='skyblue')
-    plt.title('Average Rating vs. Sales Volume')
-    plt.xlabel('Average Rating')
-    plt.ylabel('Sales Volume')
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-            <p>The data presents the average ratings and quantity of products sold for various product lines. Let's 
-            delve into the insights derived from this information:</p>
-
-            <ul>
-              <li><strong>Positive Correlation between Average Rating and Quantity Sold:</strong></li>
-              <ul>
-                <li>Products in the "Food and Beverages" category boast the highest average rating of 7.11, indicating 
-                high customer satisfaction. This satisfaction likely translates into increased demand, as evidenced by 
-                the substantial quantity sold.</li>
-                <li>Similarly, "Health and Beauty" products also exhibit a commendable average rating of 7.00, 
-                contributing to a respectable quantity sold. This suggests that perceived quality in this category 
-                drives consumer interest and sales.</li>
-                <li>Conversely, "Home and Lifestyle" products, despite having a slightly lower average rating of 6.84, 
-                maintain a notable quantity sold. This hints at factors beyond average rating, such as utility or 
-                trendiness, influencing consumer purchasing decisions.</li>
-              </ul>
-              <li><strong>Potential for Improvement in Electronic Accessories:</strong></li>
-              <ul>
-                <li>While "Electronic Accessories" garner a decent average rating of 6.92, the quantity sold doesn't 
-                reflect the same level of consumer demand as observed in other categories. This indicates an opportunity
-                 for improvement, perhaps through enhancing product features or addressing customer pain points.</li>
-              </ul>
-              <li><strong>Exploring Customer Preferences in Fashion Accessories and Sports and Travel:</strong></li>
-              <ul>
-                <li>"Fashion Accessories" and "Sports and Travel" products demonstrate comparable average ratings and 
-                quantity sold. Further analysis could uncover nuanced preferences within these categories, guiding 
-                marketing strategies or product diversification efforts to cater to specific consumer segments.</li>
-              </ul>
-              <li><strong>Strategic Considerations for Business Growth:</strong></li>
-              <ul>
-                <li>Understanding the relationship between average rating and quantity sold enables businesses to 
-                strategize effectively. By focusing on enhancing product quality, customer experience, or marketing 
-                initiatives, companies can capitalize on high-performing categories and address weaknesses to drive 
-                overall growth.</li>
-              </ul>
-            </ul>
-            
-            <p>In conclusion, this analysis underscores the significance of both customer satisfaction and sales volume 
-            in shaping business success. By leveraging insights from average ratings and quantity sold, companies can 
-            refine their product offerings, tailor marketing strategies, and optimize operational efforts to meet 
-            consumer needs and drive sustainable growth.</p>
-                        '''
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Average Rating vs. Sales Volume">', explanation
-
-
-def product_lines_gross_income():
-    monthly_income = dataset.groupby('Product line')['gross income'].sum().sort_values()
-    sns.lineplot(x=monthly_income.index, y=monthly_income.values)
-    plt.title('Product Line Gross Income')
-    plt.xlabel('Product line')
-    plt.xticks(rotation=45)
-    plt.ylabel('Gross Income')
-    plt.grid(True)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-        <p><strong>Gross Income by Product Line:</strong></p>
-
-        <p>The table below displays the gross income for each product line:</p>
-        
-        <table>
-          <tr>
-            <th>Product Line</th>
-            <th>Gross Income ($)</th>
-          </tr>
-          <tr>
-            <td>Health and Beauty</td>
-            <td>2342.5590</td>
-          </tr>
-          <tr>
-            <td>Home and Lifestyle</td>
-            <td>2564.8530</td>
-          </tr>
-          <tr>
-            <td>Fashion Accessories</td>
-            <td>2585.9950</td>
-          </tr>
-          <tr>
-            <td>Electronic Accessories</td>
-            <td>2587.5015</td>
-          </tr>
-          <tr>
-            <td>Sports and Travel</td>
-            <td>2624.8965</td>
-          </tr>
-          <tr>
-            <td>Food and Beverages</td>
-            <td>2673.5640</td>
-          </tr>
-        </table>
-        
-        <p><strong>Insights:</strong></p>
-        
-        <ol>
-          <li><strong>Food and Beverages:</strong> With a gross income of $2673.5640, the Food and Beverages category 
-          generates the highest revenue among all product lines.</li>
-          <li><strong>Sports and Travel:</strong> Sports and Travel products follow closely behind with a gross income 
-          of $2624.8965, indicating strong performance in generating revenue.</li>
-          <li><strong>Electronic Accessories and Fashion Accessories:</strong> Both Electronic Accessories and Fashion 
-          Accessories contribute significantly to the overall gross income, with $2587.5015 and $2585.9950 respectively.
-          </li>
-          <li><strong>Home and Lifestyle:</strong> Home and Lifestyle products generate a gross income of $2564.8530, 
-          making a notable contribution to the company's revenue stream.</li>
-          <li><strong>Health and Beauty:</strong> Health and Beauty products have a gross income of $2342.5590, 
-          indicating their financial significance within the product lineup.</li>
-        </ol>
-        
-        <p>These insights provide valuable information for assessing the financial performance of each product line and 
-        can aid in strategic decision-making and resource allocation within the business.</p>
-        '''
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Product Lines Gross Income">', explanation
-
-
-def average_ratings_by_product_lines():
-    mean_ratings = dataset.groupby('Product line')['Rating'].mean().reset_index()
-
-    sns.barplot(x='Product line', y='Rating', data=mean_ratings)
-    plt.xticks(rotation=45)
-    plt.title('Average Ratings by Product Line')
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-    <p><strong>Insights:</strong></p>
-
-    <p>The table presents the average ratings for various product lines based on customer feedback:</p>
-    
-    <table>
-      <tr>
-        <th>Product Line</th>
-        <th>Average Rating</th>
-      </tr>
-      <tr>
-        <td>Electronic Accessories</td>
-        <td>6.92</td>
-      </tr>
-      <tr>
-        <td>Fashion Accessories</td>
-        <td>7.03</td>
-      </tr>
-      <tr>
-        <td>Food and Beverages</td>
-        <td>7.11</td>
-      </tr>
-      <tr>
-        <td>Health and Beauty</td>
-        <td>7.00</td>
-      </tr>
-      <tr>
-        <td>Home and Lifestyle</td>
-        <td>6.84</td>
-      </tr>
-      <tr>
-        <td>Sports and Travel</td>
-        <td>6.92</td>
-      </tr>
-    </table>
-    
-    <p>Here are the key insights from the data:</p>
-    
-    <ol>
-      <li><strong>Fashion Accessories:</strong> Fashion Accessories have the highest average rating of 7.03, indicating 
-      strong customer satisfaction with this product category.</li>
-      <li><strong>Food and Beverages:</strong> Food and Beverages closely follow with an average rating of 7.11, 
-      suggesting high customer satisfaction and positive feedback for items in this category.</li>
-      <li><strong>Health and Beauty:</strong> Health and Beauty products maintain a commendable average rating of 7.00, 
-      reflecting positive customer sentiment towards these items.</li>
-      <li><strong>Electronic Accessories and Sports and Travel:</strong> Both Electronic Accessories and Sports and 
-      Travel products have an average rating of 6.92, indicating moderate to high satisfaction levels among customers.
-      </li>
-      <li><strong>Home and Lifestyle:</strong> Home and Lifestyle products have a slightly lower average rating of 6.84,
-       suggesting room for improvement or potential areas where customer expectations may not be fully met.</li>
-    </ol>
-    
-    <p>These insights provide valuable feedback for businesses to assess customer satisfaction, identify strengths and 
-    weaknesses in product categories, and tailor strategies to enhance overall customer experience.</p>
-    '''
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Average Ratings by Product Line">', explanation
-
-
-def sales_volume_segmented_by_gender_plot():
-    sns.barplot(x='Product line', y='Quantity', hue='Gender', data=dataset)
-
-    plt.title('Sales Volume by Product Line, Segmented by Gender')
-    plt.xticks(rotation=17)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-    explanation = '''
-    <p>Total profitability by product line provides a comprehensive insight into the financial performance of each 
-    product category within a business. By examining the gross income generated by each product line, we gain valuable 
-    understanding of their respective contributions to the overall profitability of the company.</p>
-
-    <p>In the provided dataset, we observe the gross income for various product lines:</p>
-
-    <ul>
-        <li><strong>Electronic Accessories:</strong> The gross income for this product line stands at $2587.5015.</li>
-        <li><strong>Fashion Accessories:</strong> This category yields a gross income of $2585.9950.</li>
-        <li><strong>Food and Beverages:</strong> Generating $2673.5640 in gross income, this segment showcases a strong 
-        performance.</li>
-        <li><strong>Health and Beauty:</strong> Gross income in this sector amounts to $2342.5590, indicating its 
-        financial significance.</li>
-        <li><strong>Home and Lifestyle:</strong> With a gross income of $2564.8530, this category makes a notable 
-        contribution to the company's profitability.</li>
-        <li><strong>Sports and Travel:</strong> This product line shows a gross income of $2624.8965, highlighting its 
-        competitive performance.</li>
-    </ul>
-
-    <p>Analyzing these figures allows us to discern the relative profitability of each product line. By identifying 
-    high-performing sectors, businesses can allocate resources effectively, capitalize on strengths, and address 
-    weaknesses. Moreover, this analysis facilitates strategic decision-making, enabling companies to optimize their 
-    product mix, marketing strategies, and operational activities to enhance overall profitability.</p>
-    '''
-
-    return (f'<img src="data:image/png;base64,{plot_base64}" alt="Sales Volume by Product Line, Segmented '
-            f'by Gender">'), explanation
-
-
-def generate_monthly_income_plot():
-    dataset['Date'] = pd.to_datetime(dataset['Date'])
-    dataset['Month'] = dataset['Date'].dt.to_period('M')
-    monthly_income = dataset.groupby(['Month', 'Product line'])['gross income'].sum().unstack()
-
-    plt.figure(figsize=(10, 6))
-    monthly_income.plot(kind='line', marker='o')
-    plt.title('Monthly Gross Income by Product Line')
-    plt.xlabel('Month')
-    plt.ylabel('Gross Income')
-    plt.xticks(rotation=45)
-    plt.grid(True)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-    <p>The provided data represents the monthly gross income for each product line over a period of time. Here's a 
-    glimpse of the trends for the first three months of 2019:</p>
-
-    <table>
-      <tr>
-        <th>Month</th>
-        <th>Electronic Accessories</th>
-        <th>Sports and Travel</th>
-      </tr>
-      <tr>
-        <td>2019-01</td>
-        <td>$896.7280</td>
-        <td>$1031.7630</td>
-      </tr>
-      <tr>
-        <td>2019-02</td>
-        <td>$826.8050</td>
-        <td>$657.6005</td>
-      </tr>
-      <tr>
-        <td>2019-03</td>
-        <td>$863.9685</td>
-        <td>$935.5330</td>
-      </tr>
-    </table>
-
-    <p>From this snippet, it appears that in January 2019, Sports and Travel products generated the highest gross 
-    income, followed by Electronic Accessories. However, in February and March, Electronic Accessories saw a decrease 
-    in gross income, while Sports and Travel maintained a relatively stable income level.</p>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Monthly Gross Income by Product Line">', explanation
-
-
-def generate_gross_income_by_gender_plot():
-    plt.figure(figsize=(12, 6))
-    gross_gender = sns.barplot(x='Product line', y='Quantity', hue='Gender', data=dataset)
-    gross_gender.plot()
-    plt.title('Gross Income by Product Line, Grouped by Gender')
-    plt.xlabel('Product Line')
-    plt.ylabel('Gross Income')
-    plt.xticks(rotation=90)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-
-    explanation = '''
-        <p>This plot shows the gross income for each product line, categorized by gender.<p>
-        <p>It provides insights into how different product lines perform in terms of gross income 
-        for both male and female customers.<p>
-        '''
-
-    return (f'<img src="data:image/png;base64,{plot_base64}" alt="Gross Income by Product Line, Grouped by Gender">',
-            explanation)
-
-
-def generate_monthly_gross_income_plot():
-    dataset['Date'] = pd.to_datetime(dataset['Date'])
-    dataset['Month'] = dataset['Date'].dt.to_period('M')
-    monthly_income = dataset.groupby('Month')['gross income'].sum()
-
-    plt.figure(figsize=(10, 6))
-    monthly_income.plot(kind='line', marker='o')
-    plt.title('Monthly Gross Income')
-    plt.xlabel('Month')
-    plt.ylabel('Gross Income')
-    plt.grid(True)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-
-    plt.close()
-
-    explanation = '''
-    <p>The provided data illustrates the trend of monthly gross income over the first three months of 2019:</p>
-
-    <table>
-      <tr>
-        <th>Month</th>
-        <th>Gross Income</th>
-      </tr>
-      <tr>
-        <td>2019-01</td>
-        <td>$5537.708</td>
-      </tr>
-      <tr>
-        <td>2019-02</td>
-        <td>$4629.494</td>
-      </tr>
-      <tr>
-        <td>2019-03</td>
-        <td>$5212.167</td>
-      </tr>
-    </table>
-
-    <p>This data suggests that there was a peak in gross income in January 2019, followed by a decrease in February, 
-    and then a slight increase again in March. Understanding the fluctuations in monthly gross income can help 
-    businesses in financial planning, identifying seasonal trends, and adjusting their strategies to maximize revenue 
-    and profitability throughout the year.</p>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Monthly Gross Income">', explanation
-
-
-def generate_total_gross_income_by_branch_plot():
-    branch_income = dataset.groupby('Branch')['gross income'].sum().reset_index()
-
-    plt.figure(figsize=(10, 6))
-    sns.barplot(x='Branch', y='gross income', data=branch_income)
-    plt.title('Total Gross Income by Branch')
-    plt.xlabel('Branch')
-    plt.ylabel('Total Gross Income')
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-
-    plt.close()
-
-    explanation = '''
-    <p>The provided data presents the total gross income for each branch:</p>
-
-    <table>
-      <tr>
-        <th>Branch</th>
-        <th>Gross Income</th>
-      </tr>
-      <tr>
-        <td>A</td>
-        <td>$5057.1605</td>
-      </tr>
-      <tr>
-        <td>B</td>
-        <td>$5057.0320</td>
-      </tr>
-      <tr>
-        <td>C</td>
-        <td>$5265.1765</td>
-      </tr>
-    </table>
-
-    <p>From this information, it appears that Branch C has the highest total gross income, followed closely by Branch A 
-    and then Branch B. Understanding the gross income distribution across branches can help businesses in evaluating 
-    branch performance, allocating resources effectively, and identifying areas for improvement.</p>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Total Gross Income by Branch">', explanation
-
-
-def generate_profitability_plot():
-    product_profitability = dataset.groupby('Product line')['gross income'].sum()
-
-    plt.figure(figsize=(12, 6))
-    product_profitability.plot(kind='bar', color='lightgreen')
-    plt.title('Total Profitability by Product Line')
-    plt.xlabel('Product line')
-    plt.ylabel('Total Profitability')
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-    explanation = '''
-    <p>Total profitability by product line provides a comprehensive insight into the financial performance of each 
-    product category within a business. By examining the gross income generated by each product line, we gain valuable 
-    understanding of their respective contributions to the overall profitability of the company.</p>
-
-    <p>In the provided dataset, we observe the gross income for various product lines:</p>
-
-    <ul>
-        <li><strong>Electronic Accessories:</strong> The gross income for this product line stands at $2587.5015.</li>
-        <li><strong>Fashion Accessories:</strong> This category yields a gross income of $2585.9950.</li>
-        <li><strong>Food and Beverages:</strong> Generating $2673.5640 in gross income, this segment showcases a strong 
-        performance.</li>
-        <li><strong>Health and Beauty:</strong> Gross income in this sector amounts to $2342.5590, indicating its 
-        financial significance.</li>
-        <li><strong>Home and Lifestyle:</strong> With a gross income of $2564.8530, this category makes a notable 
-        contribution to the company's profitability.</li>
-        <li><strong>Sports and Travel:</strong> This product line shows a gross income of $2624.8965, highlighting its 
-        competitive performance.</li>
-    </ul>
-
-    <p>Analyzing these figures allows us to discern the relative profitability of each product line. By identifying 
-    high-performing sectors, businesses can allocate resources effectively, capitalize on strengths, and address 
-    weaknesses. Moreover, this analysis facilitates strategic decision-making, enabling companies to optimize their 
-    product mix, marketing strategies, and operational activities to enhance overall profitability.</p>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Total Profitability by Product Line">', explanation
-
-
-def generate_revenue_plot():
-    product_revenue = dataset.groupby('Product line')['Total'].sum()
-    plt.figure(figsize=(12, 6))
-    plt.subplot(1, 2, 1)
-    product_revenue.plot(kind='bar', color='skyblue')
-    plt.title('Total Revenue by Product Line')
-    plt.xlabel('Product line')
-    plt.ylabel('Total Revenue')
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-    explanation = '''
-    <p>This metric provides valuable insights into the revenue-generating potential of different product lines, aiding 
-    in strategic decision-making and resource allocation.</p>
-    <p>In the provided dataset, we observe the total revenue for various product lines:</p>
-    <ul>
-        <li><strong>Electronic Accessories:</strong> This product line contributes a total revenue of $54,337.5315.</li>
-        <li><strong>Fashion Accessories:</strong> Generating $54,305.8950 in total revenue, this category demonstrates 
-        strong performance.</li>
-        <li><strong>Food and Beverages:</strong> With a total revenue of $56,144.8440, this segment emerges as a 
-        significant revenue generator.</li>
-        <li><strong>Health and Beauty:</strong> The total revenue for this category amounts to $49,193.7390.</li>
-        <li><strong>Home and Lifestyle:</strong> This product line yields a total revenue of $53,861.9130, indicating 
-        its importance in the company's revenue stream.</li>
-        <li><strong>Sports and Travel:</strong> Generating $55,122.8265 in total revenue, this category showcases robust
-         performance.</li>
-    </ul>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Total Revenue by Product Line">', explanation
-
-
-def generate_sales_volume_plot():
-    sales_volume = dataset.groupby('Product line')['Quantity'].sum()
-
-    # Visualize sales volume
-    plt.figure(figsize=(10, 6))
-    sales_volume.sort_values().plot(kind='barh', color='salmon')
-    plt.yticks(rotation=45)
-    plt.title('Total Sales Volume by Product Line')
-    plt.xlabel('Total Sales Volume')
-    plt.ylabel('Product line')
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
-    explanation = '''
-    <p>From the provided data, it's clear that electronic accessories have the highest total sales volume among all 
-    product lines, with 971 units sold. Following closely behind are sports and travel products, with a total sales 
-    volume of 920 units. Fashion accessories and home and lifestyle items also perform strongly, with 902 and 911 units 
-    sold respectively. Food and beverages, health and beauty products fall slightly behind in terms of total sales 
-    volume, with 952 and 854 units sold respectively.</p>
-
-    <p>This breakdown of sales volume by product line can help in understanding consumer preferences and market trends. 
-    It indicates which product categories are more popular or in higher demand compared to others. Businesses can 
-    utilize this information to adjust their marketing strategies, inventory management, and product offerings to better
-     meet customer needs and maximize sales.</p>
-    '''
-
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Total Sales Volume by Product Line">', explanation
+IMAGE_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'webp': 'image/webp'}
+
+# Per-stage timings of every request, served at /metrics; PROFILE_INTERVAL (seconds) turns on stack sampling
+# and keeps the folded stacks of the slowest requests in PROFILE_DIR
+metrics = instrumentation.Metrics()
+slowest_profiles = None
+if os.environ.get('PROFILE_INTERVAL'):
+    instrumentation.enable_sampling(float(os.environ['PROFILE_INTERVAL']))
+    slowest_profiles = instrumentation.SlowestProfiles(os.environ.get('PROFILE_DIR', 'profiles'),
+                                                       keep=int(os.environ.get('PROFILE_KEEP', 10)))
+
+# Rendered charts are reused until the dataset fingerprint changes
+plot_cache = PlotCache(max_entries=int(os.environ.get('PLOT_CACHE_SIZE', 64)),
+                       directory=os.environ.get('PLOT_CACHE_DIR'))
+
+# Pages and API bodies that only change with the data, rendered once per dataset version and request and kept
+# compressed in each encoding clients ask for
+page_cache = CompressedCache(max_bytes=int(os.environ.get('PAGE_CACHE_MB', 32)) * 1024 * 1024)
+
+# Visualization type -> builder in charts.py, which is only imported once a chart is rendered, and the data it reads:
+# either cube tables, so the chart only changes when those aggregates do, or 'rows' for the whole dataset
+Chart = namedtuple('Chart', ['builder', 'inputs'])
+
+PRODUCT_LINES = (('Product line',),)
+# The gender charts read the cube, unless CHART_MODE=exact has them bootstrap over every row (see charts.py)
+BY_GENDER = 'rows' if os.environ.get('CHART_MODE') == 'exact' else (('Product line', 'Gender'),)
+VISUALIZATIONS = {
+    'product_distribution': Chart('generate_product_distribution_plot', PRODUCT_LINES),
+    'profitability': Chart('generate_profitability_plot', PRODUCT_LINES),
+    'revenue': Chart('generate_revenue_plot', PRODUCT_LINES),
+    'sales_volume': Chart('generate_sales_volume_plot', PRODUCT_LINES),
+    'sales_volume_by_gender': Chart('sales_volume_segmented_by_gender_plot', BY_GENDER),
+    'monthly_income': Chart('generate_monthly_income_plot', (('Month', 'Product line'),)),
+    'gross_income_by_gender': Chart('generate_gross_income_by_gender_plot', BY_GENDER),
+    'monthly_gross_income': Chart('generate_monthly_gross_income_plot', (('Month',),)),
+    'total_gross_income_by_branch': Chart('generate_total_gross_income_by_branch_plot', (('Branch',),)),
+    'average_ratings_by_product_lines': Chart('average_ratings_by_product_lines', PRODUCT_LINES),
+    'product_lines_gross_income': Chart('product_lines_gross_income', PRODUCT_LINES),
+    'average_ratings_vs_sales_volume': Chart('average_ratings_vs_sales_volume', PRODUCT_LINES),
+    'cogs_and_gross_income': Chart('cogs_gross_income', 'rows'),
+    'correlation_heatmap': Chart('correlation_heatmap', 'rows'),
+}
+
+
+def chart_version(visualization_type, filters=()):
+    # A filtered chart depends on rows of every dimension, so it follows the whole-dataset version
+    if filters:
+        return hashlib.sha1(f'{data.version}|{filters!r}'.encode()).hexdigest()
+    return data.inputs_version(VISUALIZATIONS[visualization_type].inputs)
+
+
+def generate_visualization(visualization_type, fmt='png', filters=()):
+    from explanations import explain
+
+    if visualization_type not in VISUALIZATIONS or (filters and not data.matches(filters)):
+        return None, None, None
+    instrumentation.label(chart=visualization_type)
+    version = chart_version(visualization_type, filters)
+    # What remains of the wait once the worker's own stages are merged in is queueing and transfer
+    with instrumentation.stage('render_wait'):
+        job = submit_render(visualization_type, fmt, filters, version)
+        image, alt = job.future.result()
+        if job.stages is not None:
+            instrumentation.merge(job.stages)
+    with instrumentation.stage('explain'):
+        explanation = explain(visualization_type, version, filters)
+    return image, alt, explanation
+
+
+def submit_render(visualization_type, fmt='png', filters=(), version=None):
+    version = version or chart_version(visualization_type, filters)
+    return render_jobs.submit(plot_cache.key(f'{visualization_type}.{fmt}', version), visualization_type, fmt,
+                              filters)
+
+
+def _charts():
+    import charts
+    return charts
+
+
+def render_chart(visualization_type, fmt, filters=()):
+    # Filters travel to the worker instead of the rows, which it resolves through its own copy of the index.
+    # The worker's stage timings go back with the chart, since it may run in another process.
+    chart = VISUALIZATIONS[visualization_type]
+    with instrumentation.recording() as recorder:
+        with instrumentation.stage('data'):
+            # Builds whatever the builder reads first, so the drawing stage is only the drawing
+            source = data.filtered(filters) if filters else data
+            getattr(source, 'dataset' if chart.inputs == 'rows' else 'cube')
+        with instrumentation.stage('draw'):
+            rendered = getattr(_charts(), chart.builder)(fmt, source)
+    return rendered, recorder.snapshot()
+
+
+render_pool = RenderPool(render_chart, workers=int(os.environ.get('RENDER_WORKERS', 0)) or None,
+                         max_queue=int(os.environ.get('RENDER_QUEUE_SIZE', 32)),
+                         kind=os.environ.get('RENDER_POOL', 'thread'))
+render_jobs = RenderJobs(render_pool, plot_cache, max_finished=int(os.environ.get('RENDER_JOBS_KEPT', 64)))
+
+# Seconds the dashboard waits for renders; charts still rendering after that are sent as placeholders that the
+# page fills in when their jobs finish
+DASHBOARD_BUDGET = float(os.environ.get('DASHBOARD_BUDGET', 10))
+
+
+@app.errorhandler(RenderQueueFull)
+def render_queue_full(e):
+    return jsonify(error=str(e)), 503, {'Retry-After': '5'}
+
+
+@app.errorhandler(FiltersUnavailable)
+@app.errorhandler(InvalidFilters)
+def invalid_filters(e):
+    return jsonify(error=str(e)), 400
+
+
+def warm_plot_cache():
+    for visualization_type in VISUALIZATIONS:
+        generate_visualization(visualization_type)
+
+
+def _drop_stale_charts():
+    plot_cache.invalidate(keep_fingerprints={chart_version(name) for name in VISUALIZATIONS})
+    page_cache.clear()
+    render_pool.restart()
+
+
+def set_dataset(frame):
+    # Swap in a new dataset and drop everything derived from the old one
+    data.replace(frame)
+    _drop_stale_charts()
+
+
+def ingest_rows(frame):
+    # Append a validated batch; only charts whose inputs changed are rendered again
+    appended = data.append(frame)
+    _drop_stale_charts()
+    return appended
+
+
+# New sales batches are shared between worker processes through a directory each of them replays
+batch_directory = (BatchDirectory(os.environ['INGEST_DIR'], ingest_rows,
+                                  interval=float(os.environ.get('INGEST_INTERVAL', 5)))
+                   if os.environ.get('INGEST_DIR') else None)
+
+
+@app.before_request
+def start_batch_watcher():
+    # Started per process on its first request, since threads do not survive a pre-fork server's fork
+    if batch_directory is not None:
+        batch_directory.start()
+
+
+@app.before_request
+def sync_dataset():
+    # Batches other workers stored in the shared SQLite store (DATASET_BACKEND=sqlite)
+    if data.sync():
+        _drop_stale_charts()
+
+
+@app.before_request
+def start_recording():
+    instrumentation.begin()
+
+
+def _finish_recording(recorder, endpoint):
+    instrumentation.end(recorder)
+    metrics.observe(recorder, endpoint)
+    if slowest_profiles is not None:
+        slowest_profiles.offer(recorder, endpoint)
 
 
+@app.after_request
+def add_server_timing(response):
+    # Streamed bodies are still to be produced, so metrics are recorded once the response is closed
+    recorder = instrumentation.current()
+    if recorder is not None:
+        response.headers['Server-Timing'] = recorder.server_timing()
+        response.call_on_close(functools.partial(_finish_recording, recorder, request.endpoint or 'unmatched'))
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    # Bodies built per request are compressed as they go out, streamed ones chunk by chunk; cached ones already
+    # carry their encoding, and event streams and images in compressed formats are sent as they are
+    if response.direct_passthrough or 'Content-Encoding' in response.headers or not compressible(response.mimetype) \
+            or response.mimetype == 'text/event-stream':
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if response.is_streamed:
+        if encoding is not None:
+            response.response = compress_stream(response.response, encoding)
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+        return response
+    body = response.get_data()
+    if encoding is not None and len(body) >= MIN_SIZE:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def cached_response(build, *key):
+    # build() makes the response when it is not cached yet; the key names what it depends on besides the path
+    # and dataset version
+    return encoded_response(repr((request.path, data.version) + key), build)
+
+
+def encoded_response(key, build, cache_control='no-cache'):
+    # The cached body for key in the encoding the client prefers. Each encoding has an ETag of its own, so
+    # browsers revalidate with If-None-Match.
+    encoding = negotiate(request.accept_encodings)
+    tag = hashlib.sha1(key.encode()).hexdigest()
+    # Bodies too small to compress are sent as they are, under the plain tag
+    tags = [f'{tag}-{encoding}', tag] if encoding else [tag]
+    matched = [t for t in tags if t in request.if_none_match] if request.method in ('GET', 'HEAD') else []
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched[0])
+    else:
+        cached = page_cache.get(key, encoding)
+        if cached is None:
+            built = build()
+            page_cache.put(key, built.content_type, built.get_data())
+            cached = page_cache.get(key, encoding)
+            if cached is None:
+                # A body larger than the whole cache is compressed for this response only
+                body = built.get_data()
+                used = encoding if encoding is not None and len(body) >= MIN_SIZE else None
+                cached = built.content_type, compress(body, used) if used else body, used
+        content_type, body, used = cached
+        response = Response(body, content_type=content_type)
+        if used:
+            response.headers['Content-Encoding'] = used
+        response.set_etag(f'{tag}-{used}' if used else tag)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+
+# Reports which parts of the lazily built state have been loaded so far
+@app.route('/ready')
+def ready():
+    return jsonify(data.status())
+
+
+# The page for a chart and filters is rendered once per dataset version; a cached page skips the render wait,
+# since the image it links to is fetched, and rendered if need be, on its own
 @app.route('/', methods=['GET', 'POST'])
 def index():
+    from row_index import parse_filters
+
+    filters = parse_filters(request.values)
+    visualization_type = request.form['visualization_type'] if request.method == 'POST' else None
+    return cached_response(functools.partial(_index_page, visualization_type, filters), visualization_type, filters)
+
+
+def _index_page(visualization_type, filters):
+    from row_index import PARAMETERS, filter_params
+
     title = 'Supermarket Sales Analysis'
     plot_type = None
     plot = None
     explanation = None
 
-    if request.method == 'POST':
-        visualization_type = request.form['visualization_type']
-        plot, explanation = generate_visualization(visualization_type)
+    if visualization_type is not None:
+        image, alt, explanation = generate_visualization(visualization_type, filters=filters)
+        if image is not None:
+            # The version parameter lets browsers cache the image until the data it shows changes
+            plot = {'url': url_for('plot_image', visualization_type=visualization_type, fmt='png',
+                                   v=chart_version(visualization_type, filters)[:12], **filter_params(filters)),
+                    'alt': alt}
+        elif filters:
+            explanation = 'No sales match the selected filters.'
         plot_type = visualization_type.replace('_', ' ').title()
 
-    return render_template('index.html', title=title, plot_type=plot_type, plot=plot,
-                           explanation=explanation)
+    with instrumentation.stage('template'):
+        return Response(render_template('index.html', title=title, plot_type=plot_type, plot=plot,
+                                        explanation=explanation, filter_options=data.filter_options(),
+                                        parameters=PARAMETERS, selected=dict(filters),
+                                        dashboard_url=url_for('dashboard', **filter_params(filters))))
+
+
+def _dashboard_chart(visualization_type, job, filters):
+    from explanations import explain
+
+    chart = _job_status(job)
+    chart['title'] = visualization_type.replace('_', ' ').title()
+    # Renders ran side by side, so their stages are added as they are rather than nested in the wait
+    if job.stages is not None:
+        instrumentation.merge(job.stages)
+    with instrumentation.stage('explain'):
+        chart['explanation'] = explain(visualization_type, chart_version(visualization_type, filters), filters)
+    return chart
+
+
+def _dashboard_charts(jobs, filters, budget):
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    # Charts go out in the order they finish; those that miss the deadline follow as placeholders
+    deadline = time.monotonic() + budget
+    pending = {job.future: (visualization_type, job) for visualization_type, job in jobs}
+    while pending:
+        with instrumentation.stage('render_wait'):
+            done, _ = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            yield _dashboard_chart(*pending.pop(future), filters)
+    for visualization_type, job in pending.values():
+        yield _dashboard_chart(visualization_type, job, filters)
+
+
+# Every chart on one page, rendered concurrently and streamed into the page as each one finishes
+@app.route('/dashboard')
+def dashboard():
+    from row_index import parse_filters
+
+    filters = parse_filters(request.args)
+    if filters and not data.matches(filters):
+        return stream_template('dashboard.html', charts=[], message='No sales match the selected filters.')
+
+    # The aggregates and rows the charts read are built once, here, before any render starts: thread workers
+    # share them, and process workers forked from here inherit them
+    with instrumentation.stage('data'):
+        source = data.filtered(filters) if filters else data
+        source.cube
+        source.correlations
+    jobs = [(visualization_type, submit_render(visualization_type, filters=filters))
+            for visualization_type in VISUALIZATIONS]
+    return stream_template('dashboard.html', charts=_dashboard_charts(jobs, filters, DASHBOARD_BUDGET), message=None)
+
+
+# Raw chart bytes with validators, so browsers and proxies can cache them
+@app.route('/plot/<visualization_type>.<any(png, svg, webp):fmt>')
+def plot_image(visualization_type, fmt):
+    from row_index import parse_filters
+
+    filters = parse_filters(request.args)
+    if visualization_type not in VISUALIZATIONS:
+        abort(404)
+    if filters and not data.matches(filters):
+        abort(404, 'No sales match these filters')
+
+    version = chart_version(visualization_type, filters)
+    key = plot_cache.key(f'{visualization_type}.{fmt}', version)
+    if request.args.get('v') == version[:12]:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, no-cache'
+
+    if compressible(IMAGE_MIMETYPES[fmt]):
+        # SVG is text: compressed once per encoding and cached, under an ETag per encoding
+        return encoded_response(key, lambda: Response(generate_visualization(visualization_type, fmt, filters)[0],
+                                                      mimetype=IMAGE_MIMETYPES[fmt]), cache_control)
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        image, _, _ = generate_visualization(visualization_type, fmt, filters)
+        response = Response(image, mimetype=IMAGE_MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _job_status(job):
+    from row_index import filter_params
+
+    visualization_type, fmt, filters = job.args
+    status = {'job': job.id, 'visualization_type': visualization_type, 'format': fmt, 'status': job.status,
+              'status_url': url_for('render_job', job_id=job.id),
+              'events_url': url_for('render_job_events', job_id=job.id)}
+    if status['status'] == 'done':
+        status['image_url'] = url_for('plot_image', visualization_type=visualization_type, fmt=fmt,
+                                      v=chart_version(visualization_type, filters)[:12], **filter_params(filters))
+        status['alt'] = job.future.result()[1]
+    elif status['status'] == 'failed':
+        status['error'] = job.error()
+    return status
+
+
+# Starts rendering a chart without waiting for it; identical requests share one job, whose id the response names
+@app.route('/api/render/<visualization_type>.<any(png, svg, webp):fmt>', methods=['POST'])
+def submit_render_job(visualization_type, fmt):
+    from row_index import parse_filters
+
+    filters = parse_filters(request.values)
+    if visualization_type not in VISUALIZATIONS:
+        abort(404)
+    if filters and not data.matches(filters):
+        abort(404, 'No sales match these filters')
+
+    job = submit_render(visualization_type, fmt, filters)
+    status = _job_status(job)
+    return jsonify(status), 200 if status['status'] == 'done' else 202, {'Location': status['status_url']}
+
+
+@app.route('/api/render/jobs/<job_id>')
+def render_job(job_id):
+    job = render_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(_job_status(job)), {'Cache-Control': 'no-store'}
+
+
+def _event(name, payload):
+    return f'event: {name}\ndata: {json.dumps(payload)}\n\n'
+
+
+# Server-sent events: the job's status now, then once more when it finishes, with comments keeping the stream open
+@app.route('/api/render/jobs/<job_id>/events')
+def render_job_events(job_id):
+    job = render_jobs.get(job_id)
+    if job is None:
+        abort(404)
+
+    def events():
+        status = _job_status(job)
+        yield _event(status['status'], status)
+        if job.future.done():
+            return
+        while True:
+            try:
+                job.future.exception(timeout=15)
+                break
+            except TimeoutError:
+                yield ': keep-alive\n\n'
+        status = _job_status(job)
+        yield _event(status['status'], status)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+
+# Appends an uploaded CSV batch of sales rows to the live dataset
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify(error='Upload the new sales rows as a CSV file named "file"'), 400
+    payload = upload.read()
+    try:
+        frame = read_batch(io.BytesIO(payload))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    appended = ingest_rows(frame)
+    if batch_directory is not None:
+        batch_directory.write(payload)
+    return jsonify(appended=appended, rows=data.row_count(), version=data.version)
+
+
+# The series behind each chart as JSON or Arrow IPC, optionally filtered, without rendering an image
+@app.route('/api/aggregates/<visualization_type>')
+def aggregates_api(visualization_type):
+    from analytics import ARROW_MIMETYPE, HAS_ARROW, SERIES, aggregate_frame, arrow_stream, records, series_frame
+    from row_index import parse_filters
+
+    if visualization_type not in VISUALIZATIONS:
+        abort(404)
+    try:
+        filters = parse_filters(request.args, extra=('format',))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if filters and not data.matches(filters):
+        return jsonify(error='No sales match these filters'), 404
+    fmt = request.args.get('format')
+    negotiated = fmt is None
+    if negotiated:
+        fmt = 'arrow' if request.accept_mimetypes.best_match(['application/json', ARROW_MIMETYPE]) == ARROW_MIMETYPE \
+            else 'json'
+    if fmt not in ('json', 'arrow'):
+        return jsonify(error=f'Unsupported format: {fmt}'), 400
+    if fmt == 'arrow' and not HAS_ARROW:
+        return jsonify(error='Arrow output needs pyarrow installed on the server'), 406
+
+    def build():
+        if filters and visualization_type in SERIES and data.store is not None:
+            # Filters become a WHERE clause over the store's indexes, so no rows are read into memory
+            frame = series_frame(visualization_type, data.store.cube([SERIES[visualization_type][0]], filters))
+        else:
+            frame = aggregate_frame(visualization_type, data.filtered(filters) if filters else data)
+        if fmt == 'arrow':
+            return Response(arrow_stream(frame), mimetype=ARROW_MIMETYPE)
+        return jsonify(visualization_type=visualization_type, columns=list(frame.columns), rows=records(frame))
+
+    response = cached_response(build, fmt, filters)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
+
+# Correlation or covariance matrix of the numeric columns, read from running moments rather than the rows;
+# by=branch or by=product_line returns one matrix per value of that column
+@app.route('/api/correlations')
+def correlations_api():
+    from analytics import records
+    from correlations import SEGMENTS
+    from row_index import DIMENSIONS
+
+    statistic = request.args.get('statistic', 'correlation')
+    if statistic not in ('correlation', 'covariance'):
+        return jsonify(error=f'Unsupported statistic: {statistic}'), 400
+    by = request.args.get('by')
+    choices = [param for param, column in DIMENSIONS.items() if column in SEGMENTS]
+    if by is not None and by not in choices:
+        return jsonify(error=f'by must be one of: {", ".join(choices)}'), 400
+
+    def build():
+        correlations = data.correlations
+
+        def matrix(segment=None, value=None):
+            frame = correlations.frame(statistic, segment, value)
+            return {'rows': int(correlations.moments(segment, value).count),
+                    'matrix': [list(row.values()) for row in records(frame)]}
+
+        payload = {'statistic': statistic, 'columns': list(correlations.columns), **matrix()}
+        if by is not None:
+            segment = DIMENSIONS[by]
+            payload['by'] = by
+            payload['segments'] = {value: matrix(segment, value) for value in correlations.segments[segment]}
+        return jsonify(payload)
+
+    return cached_response(build, statistic, by)
 
 
-def generate_product_distribution_plot():
-    plt.figure(figsize=(10, 6))
-    sns.countplot(data=dataset, x='Product line')
-    plt.xticks(rotation=17)
-    plt.title('Distribution of Product Line')
-    plt.xlabel('Product Line')
-    plt.ylabel('Count')
+@app.route('/predict_sales', methods=['GET', 'POST'])
+def predict_sales():
+    if request.method == 'POST':
+        with instrumentation.stage('parse'):
+            unit_price = float(request.form['unit_price'])
+            quantity = int(request.form['quantity'])
+            tax_percent = float(request.form['tax_percent'])
+            gross_income = float(request.form['gross_income'])
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plot_base64 = base64.b64encode(buf.getvalue()).decode()
-    plt.close()
+        with instrumentation.stage('predict'):
+            prediction = data.sales_model.predict([[unit_price, quantity, tax_percent, gross_income]])
+            mse = data.sales_model.mse
 
-    explanation = '''
-    <p>This plot shows the distribution of product lines in the supermarket sales dataset. Each bar represents a product
-     line, and the height of the bar indicates the count of occurrences of that product line in the dataset.</p>
+        with instrumentation.stage('template'):
+            return render_template('predict_sales.html', prediction=prediction, unit_price=unit_price,
+                                   quantity=quantity, mse=mse, tax_percent=tax_percent, gross_income=gross_income)
 
-    <p>Some trends observed in the distribution:</p>
-    <ul>
-        <li>'Fashion accessories' has the highest count, indicating that it is the most frequently sold product line, 
-        followed by 'Food and beverages' and 'Electronic accessories'.</li>
-        <li>'Sports and travel' and 'Home and lifestyle' categories also show significant counts, indicating significant
-         popularity among customers.</li>
-        <li>'Health and beauty' has the lowest count among the product lines.</li>
-    </ul>
+    return render_template('predict_sales.html')
 
-    <p>Overall, this visualization provides insights into the popularity and demand for different product lines in the 
-    supermarket.</p>
-    '''
 
-    return f'<img src="data:image/png;base64,{plot_base64}" alt="Distribution of Product Line">', explanation
+def _spooled_upload(storage):
+    from sales_model import csv_to_matrices
+
+    # Flask closes request files before a streamed body runs, so predictions are read from our own spooled copy.
+    # Every chunk is parsed once before the response starts: a bad row anywhere is a 400, never a 200 whose
+    # body stops short.
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    try:
+        storage.save(spool)
+        spool.seek(0)
+        for _ in csv_to_matrices(spool):
+            pass
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _uploaded_matrices(spool):
+    from sales_model import csv_to_matrices
+
+    with spool:
+        yield from csv_to_matrices(spool)
+
+
+def _ndjson_predictions(predictions):
+    row = 0
+    for chunk in predictions:
+        yield ''.join(json.dumps({'row': row + i, 'prediction': value}) + '\n'
+                      for i, value in enumerate(chunk.tolist()))
+        row += len(chunk)
+
+
+def _csv_predictions(predictions):
+    yield 'row,prediction\n'
+    row = 0
+    for chunk in predictions:
+        yield ''.join(f'{row + i},{value!r}\n' for i, value in enumerate(chunk.tolist()))
+        row += len(chunk)
+
+
+def _timed_chunks(chunks):
+    # Predictions are computed while the body streams, so time each chunk as it is produced
+    chunks = iter(chunks)
+    while True:
+        with instrumentation.stage('predict'):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+# Score many baskets at once from a JSON array or an uploaded CSV, streaming the predictions back
+@app.route('/predict_sales/batch', methods=['POST'])
+def predict_sales_batch():
+    import pandas as pd
+    from sales_model import rows_to_matrix
+
+    uploaded = 'file' in request.files
+    # Checked before the upload is spooled and parsed
+    output = request.args.get('format', 'csv' if uploaded else 'ndjson')
+    if output not in ('csv', 'ndjson'):
+        return jsonify(error=f'Unsupported format: {output}'), 400
+
+    try:
+        if uploaded:
+            matrices = _uploaded_matrices(_spooled_upload(request.files['file']))
+        else:
+            payload = request.get_json(silent=True)
+            rows = payload.get('rows') if isinstance(payload, dict) else payload
+            matrices = [rows_to_matrix(rows)]
+    except (ValueError, pd.errors.ParserError) as e:
+        return jsonify(error=str(e)), 400
+
+    predictions = _timed_chunks(data.sales_model.predict_chunks(matrices))
+    if output == 'csv':
+        return Response(stream_with_context(_csv_predictions(predictions)), mimetype='text/csv')
+    return Response(stream_with_context(_ndjson_predictions(predictions)), mimetype='application/x-ndjson')
+
+
+# Refresh the sales model from the current dataset without restarting the server
+@app.route('/predict_sales/retrain', methods=['POST'])
+def retrain_sales_model():
+    fitted = data.retrain_sales_model()
+    return jsonify(mse=fitted.mse, fingerprint=fitted.fingerprint)
+
+
+# Route to display the dataset one page at a time; each page is rendered once per dataset version and query
+@app.route('/view_dataset')
+def view_dataset():
+    return cached_response(_dataset_page, sorted(request.args.items(multi=True)))
 
 
-@app.route('/predict_sales', methods=['GET', 'POST'])
-def predict_sales():
-    if request.method == 'POST':
-        unit_price = float(request.form['unit_price'])
-        quantity = int(request.form['quantity'])
-        tax_percent = float(request.form['tax_percent'])
-        gross_income = float(request.form['gross_income'])
-        X = dataset[['Unit price', 'Quantity', 'Tax 5%', 'gross income']]
+def _dataset_page():
+    from dataset_view import parse_view_query, select_rows, page_of, iter_row_chunks, html_rows
 
-        y = dataset['Total']
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    dataset = data.dataset
+    try:
+        query = parse_view_query(request.args, dataset)
+        positions = select_rows(dataset, query, data.version)
+    except ValueError as e:
+        abort(400, str(e))
 
-        model = LinearRegression()
-        model.fit(X_train, y_train)
-        prediction = model.predict([[unit_price, quantity, tax_percent, gross_income]])
-        mse = mean_squared_error(y_test, model.predict(X_test))
+    total = len(positions)
+    pages = max((total + query.per_page - 1) // query.per_page, 1)
+    rows = html_rows(iter_row_chunks(dataset, page_of(positions, query), query.columns))
 
-        return render_template('predict_sales.html', prediction=prediction, unit_price=unit_price,
-                               quantity=quantity, mse=mse, tax_percent=tax_percent, gross_income=gross_income)
+    def page_url(page):
+        return url_for('view_dataset', **{**request.args.to_dict(flat=False), 'page': page})
 
-    return render_template('predict_sales.html')
+    def sort_url(column):
+        order = 'desc' if query.sort == column and query.ascending else 'asc'
+        return url_for('view_dataset', **{**request.args.to_dict(flat=False), 'sort': column, 'order': order,
+                                          'page': 1})
 
+    return Response(render_template('dataset.html', columns=query.columns, rows=rows, page=query.page,
+                                    pages=pages, total=total, page_url=page_url, sort_url=sort_url))
 
-# Route to display the dataset
-@app.route('/view_dataset')
-def view_dataset():
-    # Render the dataset.html template with the dataset
-    return render_template('dataset.html', dataset=dataset_html)
+
+# Same query parameters as /view_dataset; without a page parameter every matching row is streamed in chunks
+@app.route('/view_dataset.<any(json, ndjson):fmt>')
+def view_dataset_records(fmt):
+    from dataset_view import parse_view_query, select_rows, page_of, iter_row_chunks, ndjson_lines, json_array
+
+    dataset = data.dataset
+    try:
+        query = parse_view_query(request.args, dataset, paginate=False)
+        positions = select_rows(dataset, query, data.version)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    chunks = iter_row_chunks(dataset, page_of(positions, query), query.columns)
+    if fmt == 'ndjson':
+        return Response(ndjson_lines(chunks), mimetype='application/x-ndjson')
+    return Response(json_array(chunks), mimetype='application/json')
+
+
+# For pre-fork servers (gunicorn --preload): build everything in the master so workers share it copy-on-write
+if os.environ.get('PRELOAD') == '1':
+    _charts()
+    data.preload()
+
+if os.environ.get('PLOT_CACHE_WARMUP') == '1':
+    warm_plot_cache()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+BRANCHES = {'A': 'Yangon', 'B': 'Mandalay', 'C': 'Naypyitaw'}
+PRODUCT_LINES = ['Electronic accessories', 'Fashion accessories', 'Food and beverages', 'Health and beauty',
+                 'Home and lifestyle', 'Sports and travel']
+PAYMENTS = ['Cash', 'Credit card', 'Ewallet']
+
+
+def synthetic_sales(rows, seed=0):
+    # Rows shaped like supermarket_sales.csv, with the derived money columns consistent with each other
+    rng = np.random.default_rng(seed)
+    branch = rng.choice(list(BRANCHES), rows)
+    unit_price = rng.uniform(10, 100, rows).round(2)
+    quantity = rng.integers(1, 11, rows)
+    cogs = unit_price * quantity
+    tax = cogs * 0.05
+    dates = pd.Timestamp('2019-01-01') + pd.to_timedelta(rng.integers(0, 90, rows), unit='D')
+    minutes = pd.Series(rng.integers(10 * 60, 21 * 60, rows))
+    invoice = pd.Series(np.char.mod('%09d', np.arange(rows)))
+    return pd.DataFrame({
+        'Invoice ID': (invoice.str[:3] + '-' + invoice.str[3:5] + '-' + invoice.str[5:]).to_numpy(),
+        'Branch': branch,
+        'City': pd.Series(branch).map(BRANCHES).to_numpy(),
+        'Customer type': rng.choice(['Member', 'Normal'], rows),
+        'Gender': rng.choice(['Female', 'Male'], rows),
+        'Product line': rng.choice(PRODUCT_LINES, rows),
+        'Unit price': unit_price,
+        'Quantity': quantity,
+        'Tax 5%': tax,
+        'Total': cogs + tax,
+        'Date': dates.strftime('%m/%d/%Y'),
+        'Time': ((minutes // 60).astype(str) + ':' + (minutes % 60).astype(str).str.zfill(2)).to_numpy(),
+        'Payment': rng.choice(PAYMENTS, rows),
+        'cogs': cogs,
+        'gross margin percentage': 4.761904762,
+        'gross income': tax,
+        'Rating': rng.uniform(4, 10, rows).round(1),
+    })
+
+
+def _reset_peak_rss():
+    # Linux lets a process reset its high-water mark, so each dataset size reports its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _summary(case, rows, latencies, wall=None, items=1):
+    latencies = np.asarray(latencies) * 1000
+    wall = wall if wall is not None else latencies.sum() / 1000
+    return {
+        'case': case,
+        'rows': rows,
+        'requests': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'throughput_per_s': len(latencies) * items / wall if wall else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _timed(request, repeat, before=None):
+    # Streamed bodies are only produced as they are read, and the metrics hooks run when the response is
+    # closed, so both happen inside the timed region
+    latencies = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        response = request()
+        try:
+            body = response.get_data()
+        finally:
+            response.close()
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'{response.status_code}: {body[:200].decode(errors="replace")}')
+    return latencies
+
+
+def _concurrent(app, path, requests, concurrency):
+    # Each worker thread drives its own test client, so requests overlap the way they would on a threaded server
+    def worker(count):
+        client = app.test_client()
+        return _timed(lambda: client.get(path), count)
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = [latency for share in executor.map(worker, shares) for latency in share]
+    return latencies, time.perf_counter() - start
+
+
+def run(sizes, repeat=5, concurrency=8, requests=200, charts=None, batch_rows=10000):
+    import app
+    import explanations
+    from datastore import apply_schema
+
+    flask_app = app.app
+    # Models fitted on synthetic data must not replace the one the server persists
+    app.data.model_path = None
+    client = flask_app.test_client()
+    charts = charts or list(app.VISUALIZATIONS)
+    results = []
+
+    def cold():
+        # Drop rendered charts, finished render jobs and explanations so every request renders from the data
+        app.plot_cache.invalidate()
+        app.render_jobs.clear()
+        with explanations._explanations_lock:
+            explanations._explanations.clear()
+
+    for rows in sizes:
+        _reset_peak_rss()
+        raw = synthetic_sales(rows)
+        start = time.perf_counter()
+        app.set_dataset(apply_schema(raw))
+        app.data.preload()
+        results.append(_summary('load', rows, [time.perf_counter() - start]))
+        del raw
+
+        for chart in charts:
+            path = f'/plot/{chart}.png'
+            results.append(_summary(f'chart.cold:{chart}', rows, _timed(lambda: client.get(path), repeat, cold)))
+            results.append(_summary(f'chart.cached:{chart}', rows, _timed(lambda: client.get(path), repeat)))
+        latencies, wall = _concurrent(flask_app, f'/plot/{charts[0]}.png', requests, concurrency)
+        results.append(_summary(f'chart.concurrent:{charts[0]}', rows, latencies, wall))
+
+        single = {'rows': [[50.0, 3, 7.5, 7.5]]}
+        results.append(_summary('predict.single', rows,
+                                _timed(lambda: client.post('/predict_sales/batch', json=single), repeat * 20)))
+        batch = {'rows': np.random.default_rng(1).uniform(1, 100, (batch_rows, 4)).round(2).tolist()}
+        results.append(_summary('predict.batch', rows,
+                                _timed(lambda: client.post('/predict_sales/batch', json=batch), repeat),
+                                items=batch_rows))
+
+        last_page = max(rows // 50, 1)
+        for case, path in [('view.first_page', '/view_dataset.json?page=1'),
+                           ('view.last_page', f'/view_dataset.json?page={last_page}'),
+                           ('view.sorted', '/view_dataset.json?page=1&sort=Total&order=desc'),
+                           ('view.filtered', '/view_dataset.json?page=1&filter=Branch:A')]:
+            results.append(_summary(case, rows, _timed(lambda: client.get(path), repeat)))
+        latencies, wall = _concurrent(flask_app, '/view_dataset.json?page=2', requests, concurrency)
+        results.append(_summary('view.concurrent', rows, latencies, wall))
+        print(f'{rows} rows done, peak RSS {_peak_rss_mb():.0f} MB', file=sys.stderr)
+    return results
+
+
+def _meta():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(baseline, results):
+    # Ratio of p50 latencies per (case, rows); above 1 means slower than the baseline
+    previous = {(result['case'], result['rows']): result for result in baseline['results']}
+    for result in results:
+        before = previous.get((result['case'], result['rows']))
+        if before and before['p50_ms']:
+            print(f"{result['p50_ms'] / before['p50_ms']:7.2f}x  {result['rows']:>9}  {result['case']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark chart rendering, prediction and dataset views')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='synthetic dataset rows')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per concurrent load test')
+    parser.add_argument('--chart', action='append', help='limit to these visualization types')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.concurrency, args.requests, args.chart)
+    with open(args.output, 'w') as f:
+        json.dump({'meta': _meta(), 'results': results}, f, indent=2)
+    for result in results:
+        print(f"{result['rows']:>9}  {result['case']:<50} p50 {result['p50_ms']:9.2f} ms  "
+              f"p99 {result['p99_ms']:9.2f} ms  {result['peak_rss_mb']:7.0f} MB")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
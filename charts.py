@@ -0,0 +1,293 @@
+import io
+import os
+
+import matplotlib
+import numpy as np
+import seaborn as sns
+from matplotlib.figure import Figure
+
+from context import data
+from instrumentation import stage
+from moments import Moments
+
+# Charts draw on explicit Figure objects, never through the global pyplot state
+matplotlib.use('Agg')
+
+# Keep SVG element ids stable so the same chart always serializes to the same bytes
+matplotlib.rcParams['svg.hashsalt'] = 'supermarket-sales'
+
+# Every builder draws from source: the shared data context, or a filtered DataView of it
+
+# By default the gender charts draw from cube statistics with analytic intervals, and the COGS joint plot turns
+# into hexbins past SCATTER_MAX_POINTS, so render time stays flat as the data grows. CHART_MODE=exact draws
+# them from every row with seaborn's bootstrap intervals, as before.
+EXACT = os.environ.get('CHART_MODE') == 'exact'
+SCATTER_MAX_POINTS = int(os.environ.get('SCATTER_MAX_POINTS', 5000))
+
+
+def _save_figure(fig, fmt):
+    buf = io.BytesIO()
+    with stage('encode'):
+        fig.savefig(buf, format=fmt)
+    return buf.getvalue()
+
+
+def correlation_heatmap(fmt='png', source=data):
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    sns.heatmap(source.correlations.frame(), annot=True, cmap='coolwarm', ax=ax)
+    ax.set_title('Correlation Heatmap')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Correlation Heatmap'
+
+
+def _regression_band(ax, x, y, z=1.96):
+    # Least-squares line and its confidence band from the moments of the two columns, in place of
+    # regplot's bootstrap over every point
+    moments = Moments.of(np.column_stack([x, y]))
+    (sxx, sxy), (_, syy) = moments.scatter
+    if sxx <= 0:
+        return
+    slope = sxy / sxx
+    intercept = moments.mean[1] - slope * moments.mean[0]
+    residual = max(syy - slope * sxy, 0) / max(moments.count - 2, 1)
+    grid = np.linspace(x.min(), x.max(), 100)
+    fit = intercept + slope * grid
+    half = z * np.sqrt(residual * (1 / moments.count + (grid - moments.mean[0]) ** 2 / sxx))
+    color = sns.color_palette()[0]
+    ax.plot(grid, fit, color=color)
+    ax.fill_between(grid, fit - half, fit + half, color=color, alpha=0.15, linewidth=0)
+
+
+def cogs_gross_income(fmt='png', source=data):
+    dataset = source.dataset
+    # Same layout as sns.jointplot(kind='reg'), which always draws through pyplot
+    fig = Figure(figsize=(6, 6))
+    grid = fig.add_gridspec(2, 2, width_ratios=(5, 1), height_ratios=(1, 5), wspace=0.05, hspace=0.05)
+    ax = fig.add_subplot(grid[1, 0])
+    ax_x = fig.add_subplot(grid[0, 0], sharex=ax)
+    ax_y = fig.add_subplot(grid[1, 1], sharey=ax)
+    if EXACT or len(dataset) <= SCATTER_MAX_POINTS:
+        sns.regplot(x='cogs', y='gross income', data=dataset, ax=ax)
+        sns.histplot(x=dataset['cogs'], kde=True, ax=ax_x)
+        sns.histplot(y=dataset['gross income'], kde=True, ax=ax_y)
+    else:
+        # Point density instead of overplotted points, and plain histograms instead of KDEs over every row
+        cogs, income = dataset['cogs'].to_numpy(dtype=float), dataset['gross income'].to_numpy(dtype=float)
+        ax.hexbin(cogs, income, gridsize=60, mincnt=1, bins='log', cmap='Blues')
+        _regression_band(ax, cogs, income)
+        ax_x.hist(cogs, bins=50, color=sns.color_palette()[0])
+        ax_y.hist(income, bins=50, orientation='horizontal', color=sns.color_palette()[0])
+    for marginal in (ax_x, ax_y):
+        marginal.set_axis_off()
+    ax.set_xlabel('Cost of Goods Sold (COGS)')
+    ax.set_ylabel('Gross Income')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Cost of Goods Sold and Gross income'
+
+
+def average_ratings_vs_sales_volume(fmt='png', source=data):
+    cube = source.cube
+    avg_rating = cube.mean('Product line', 'Rating')
+    sales_volume = cube.sum('Product line', 'Quantity')
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.scatter(avg_rating, sales_volume, c='skyblue')
+    ax.set_title('Average Rating vs. Sales Volume')
+    ax.set_xlabel('Average Rating')
+    ax.set_ylabel('Sales Volume')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Average Rating vs. Sales Volume'
+
+
+def product_lines_gross_income(fmt='png', source=data):
+    cube = source.cube
+    monthly_income = cube.sum('Product line', 'gross income').sort_values()
+    fig = Figure()
+    ax = fig.subplots()
+    sns.lineplot(x=monthly_income.index, y=monthly_income.values, ax=ax)
+    ax.set_title('Product Line Gross Income')
+    ax.set_xlabel('Product line')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.set_ylabel('Gross Income')
+    ax.grid(True)
+
+    image = _save_figure(fig, fmt)
+    return image, 'Product Lines Gross Income'
+
+
+def average_ratings_by_product_lines(fmt='png', source=data):
+    cube = source.cube
+    mean_ratings = cube.mean('Product line', 'Rating').reset_index()
+
+    fig = Figure()
+    ax = fig.subplots()
+    sns.barplot(x='Product line', y='Rating', data=mean_ratings, ax=ax)
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.set_title('Average Ratings by Product Line')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Average Ratings by Product Line'
+
+
+def _gender_bars(ax, source, measure):
+    if EXACT:
+        sns.barplot(x='Product line', y=measure, hue='Gender', data=source.dataset, ax=ax)
+        return
+    # Group means with analytic 95% intervals from the cube, instead of bootstrapping every row
+    keys = ('Product line', 'Gender')
+    means = source.cube.mean(keys, measure).unstack()
+    errors = source.cube.confidence(keys, measure).unstack()
+    positions = np.arange(len(means.index))
+    width = 0.8 / len(means.columns)
+    for i, (gender, color) in enumerate(zip(means.columns, sns.color_palette())):
+        ax.bar(positions - 0.4 + width * (i + 0.5), means[gender], width, yerr=errors[gender], color=color,
+               label=gender, error_kw={'ecolor': '.26', 'elinewidth': 2.25})
+    ax.set_xticks(positions, [str(line) for line in means.index])
+    ax.set_xlabel('Product line')
+    ax.set_ylabel(measure)
+    ax.legend(title='Gender')
+
+
+def sales_volume_segmented_by_gender_plot(fmt='png', source=data):
+    fig = Figure()
+    ax = fig.subplots()
+    _gender_bars(ax, source, 'Quantity')
+
+    ax.set_title('Sales Volume by Product Line, Segmented by Gender')
+    ax.tick_params(axis='x', labelrotation=17)
+
+    image = _save_figure(fig, fmt)
+    return image, 'Sales Volume by Product Line, Segmented by Gender'
+
+
+def generate_monthly_income_plot(fmt='png', source=data):
+    cube = source.cube
+    monthly_income = cube.sum(('Month', 'Product line'), 'gross income').unstack()
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    monthly_income.plot(kind='line', marker='o', ax=ax)
+    ax.set_title('Monthly Gross Income by Product Line')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Gross Income')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(True)
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Monthly Gross Income by Product Line'
+
+
+def generate_gross_income_by_gender_plot(fmt='png', source=data):
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    _gender_bars(ax, source, 'Quantity')
+    ax.set_title('Gross Income by Product Line, Grouped by Gender')
+    ax.set_xlabel('Product Line')
+    ax.set_ylabel('Gross Income')
+    ax.tick_params(axis='x', labelrotation=90)
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Gross Income by Product Line, Grouped by Gender'
+
+
+def generate_monthly_gross_income_plot(fmt='png', source=data):
+    cube = source.cube
+    monthly_income = cube.sum('Month', 'gross income')
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    monthly_income.plot(kind='line', marker='o', ax=ax)
+    ax.set_title('Monthly Gross Income')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Gross Income')
+    ax.grid(True)
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Monthly Gross Income'
+
+
+def generate_total_gross_income_by_branch_plot(fmt='png', source=data):
+    cube = source.cube
+    branch_income = cube.sum('Branch', 'gross income').reset_index()
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    sns.barplot(x='Branch', y='gross income', data=branch_income, ax=ax)
+    ax.set_title('Total Gross Income by Branch')
+    ax.set_xlabel('Branch')
+    ax.set_ylabel('Total Gross Income')
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Total Gross Income by Branch'
+
+
+def generate_profitability_plot(fmt='png', source=data):
+    cube = source.cube
+    product_profitability = cube.sum('Product line', 'gross income')
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    product_profitability.plot(kind='bar', color='lightgreen', ax=ax)
+    ax.set_title('Total Profitability by Product Line')
+    ax.set_xlabel('Product line')
+    ax.set_ylabel('Total Profitability')
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Total Profitability by Product Line'
+
+
+def generate_revenue_plot(fmt='png', source=data):
+    cube = source.cube
+    product_revenue = cube.sum('Product line', 'Total')
+    fig = Figure(figsize=(12, 6))
+    ax = fig.add_subplot(1, 2, 1)
+    product_revenue.plot(kind='bar', color='skyblue', ax=ax)
+    ax.set_title('Total Revenue by Product Line')
+    ax.set_xlabel('Product line')
+    ax.set_ylabel('Total Revenue')
+    fig.tight_layout()
+
+    image = _save_figure(fig, fmt)
+    return image, 'Total Revenue by Product Line'
+
+
+def generate_sales_volume_plot(fmt='png', source=data):
+    cube = source.cube
+    sales_volume = cube.sum('Product line', 'Quantity')
+
+    # Visualize sales volume
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    sales_volume.sort_values().plot(kind='barh', color='salmon', ax=ax)
+    ax.tick_params(axis='y', labelrotation=45)
+    ax.set_title('Total Sales Volume by Product Line')
+    ax.set_xlabel('Total Sales Volume')
+    ax.set_ylabel('Product line')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Total Sales Volume by Product Line'
+
+
+def generate_product_distribution_plot(fmt='png', source=data):
+    cube = source.cube
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    product_counts = cube.count('Product line')
+    sns.barplot(x=product_counts.index, y=product_counts.values, ax=ax)
+    ax.tick_params(axis='x', labelrotation=17)
+    ax.set_title('Distribution of Product Line')
+    ax.set_xlabel('Product Line')
+    ax.set_ylabel('Count')
+
+    image = _save_figure(fig, fmt)
+    return image, 'Distribution of Product Line'
@@ -0,0 +1,121 @@
+import glob
+import hashlib
+import io
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from aggregates import build_cube
+from correlations import correlation_moments
+from datastore import append_rows, apply_schema, dataset_fingerprint, prepare_dataset
+from sales_model import split_moments, training_fingerprint
+
+CHUNK_BYTES = 64 << 20
+SAMPLE_ROWS = 100000
+
+# Mergeable result of scanning part of the sales history: the aggregate cube, correlation moments and the sales
+# model's train and test moments over every row, plus a uniform sample of bounded size (the rows with the
+# smallest random keys) for the charts that need raw rows. trained_on fingerprints the model's columns of
+# the rows and version every column, both chained in part order.
+Partial = namedtuple('Partial', ['cube', 'correlations', 'train', 'test', 'trained_on', 'sample', 'keys', 'rows',
+                                 'version'])
+
+
+def csv_ranges(csv_path, chunk_bytes=CHUNK_BYTES):
+    # Split the CSV into byte ranges that end on a line break, so each worker parses its own range.
+    # Assumes no quoted field spans lines, which holds for the sales export.
+    size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = f.tell()
+            yield csv_path, header, start, end
+            start = end
+
+
+def _read_csv_range(csv_path, header, start, end):
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    return pd.read_csv(io.BytesIO(header + block))
+
+
+def partial_of(raw, sample_rows=SAMPLE_ROWS, seed=0):
+    dataset = prepare_dataset(apply_schema(raw))
+    keys = np.random.default_rng(seed).random(len(dataset))
+    keep = np.sort(np.argsort(keys, kind='stable')[:sample_rows])
+    train, test = split_moments(dataset)
+    return Partial(build_cube(dataset), correlation_moments(dataset), train, test, training_fingerprint(dataset),
+                   dataset.iloc[keep].reset_index(drop=True), keys[keep], len(dataset), dataset_fingerprint(dataset))
+
+
+def _scan_part(part, sample_rows, seed):
+    if isinstance(part, tuple):
+        raw = _read_csv_range(*part)
+    else:
+        raw = pd.read_parquet(part)
+    return partial_of(raw, sample_rows, seed)
+
+
+def merge_partials(left, right, sample_rows=SAMPLE_ROWS):
+    sample = append_rows(left.sample, right.sample)
+    keys = np.concatenate([left.keys, right.keys])
+    keep = np.sort(np.argsort(keys, kind='stable')[:sample_rows])
+    trained_on = hashlib.sha1(f'{left.trained_on}+{right.trained_on}'.encode()).hexdigest()
+    version = hashlib.sha1(f'{left.version}+{right.version}'.encode()).hexdigest()
+    return Partial(left.cube.merge(right.cube), left.correlations.merge(right.correlations),
+                   left.train.merge(right.train), left.test.merge(right.test), trained_on,
+                   sample.iloc[keep].reset_index(drop=True), keys[keep], left.rows + right.rows, version)
+
+
+def sales_parts(path, chunk_bytes=CHUNK_BYTES):
+    # A partitioned Parquet directory is scanned one file per task, a CSV one byte range per task
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.parquet')))
+    return list(csv_ranges(path, chunk_bytes))
+
+
+def scan_sales(path, workers=None, chunk_bytes=CHUNK_BYTES, sample_rows=SAMPLE_ROWS):
+    # Partials are folded in part order, so repeated scans give bit-identical sums, and at most two parts per
+    # worker are in flight, so memory stays bounded by the part and sample sizes rather than the history
+    parts = sales_parts(path, chunk_bytes)
+    if not parts:
+        raise ValueError(f'No sales data found in {path}')
+    workers = workers or os.cpu_count() or 1
+    merged = None
+    if workers == 1:
+        for index, part in enumerate(parts):
+            partial = _scan_part(part, sample_rows, index)
+            merged = partial if merged is None else merge_partials(merged, partial, sample_rows)
+        return merged
+
+    context = multiprocessing.get_context('fork')
+    pending, finished = {}, {}
+    next_index = 0
+
+    def collect():
+        nonlocal merged, next_index
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            finished[pending.pop(future)] = future.result()
+        while next_index in finished:
+            partial = finished.pop(next_index)
+            merged = partial if merged is None else merge_partials(merged, partial, sample_rows)
+            next_index += 1
+
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        for index, part in enumerate(parts):
+            pending[executor.submit(_scan_part, part, sample_rows, index)] = index
+            # Results waiting for an earlier part count against the limit too
+            while len(pending) + len(finished) >= 2 * workers:
+                collect()
+        while pending:
+            collect()
+    return merged
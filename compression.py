@@ -0,0 +1,124 @@
+import functools
+import gzip
+import importlib.util
+import threading
+import zlib
+from collections import OrderedDict
+
+# brotli is optional; without it clients are offered gzip only
+HAS_BROTLI = importlib.util.find_spec('brotli') is not None
+
+# Preferred first when a client accepts several with the same quality
+ENCODINGS = ('br', 'gzip') if HAS_BROTLI else ('gzip',)
+
+# Bodies smaller than this gain too little from compression to be worth it
+MIN_SIZE = 1024
+
+# Text formats; images other than SVG and Arrow streams are compressed already
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml'}
+
+# Levels for bodies compressed on every response, and for bodies compressed once and cached
+FAST_LEVELS = {'br': 4, 'gzip': 6}
+BEST_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def negotiate(accept_encodings, encodings=ENCODINGS):
+    # The encoding the client gives the highest quality, or None to send the body as it is
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE
+
+
+def compress(body, encoding, levels=FAST_LEVELS):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=levels['br'])
+    return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+
+
+def compress_stream(chunks, encoding, levels=FAST_LEVELS):
+    # A streamed body compressed as it goes: each chunk is flushed on its own, so the client can decode what
+    # has arrived without waiting for the end. Closing the stream closes the chunks it reads from.
+    if encoding == 'br':
+        import brotli
+        compressor = brotli.Compressor(quality=levels['br'])
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        # wbits=31 writes the gzip header and trailer
+        compressor = zlib.compressobj(levels['gzip'], zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        flush = functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                yield process(chunk) + flush()
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class CompressedCache:
+    # Bodies that only change with the data, with each encoding compressed once, on first request, at the
+    # best level. Entries are kept least recently used first and dropped past a total size in bytes.
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, encoding=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            mimetype, bodies = entry
+            body = bodies.get(encoding)
+        if body is None:
+            identity = bodies[None]
+            if len(identity) < MIN_SIZE:
+                return mimetype, identity, None
+            body = compress(identity, encoding, BEST_LEVELS)
+            self._add(key, encoding, body)
+        return mimetype, body, encoding
+
+    def put(self, key, mimetype, body):
+        # A body larger than the whole cache is not kept, rather than evicting every other entry on its way out
+        with self._lock:
+            if key in self._entries:
+                self._size -= sum(map(len, self._entries.pop(key)[1].values()))
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = (mimetype, {None: body})
+            self._size += len(body)
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _add(self, key, encoding, body):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and encoding not in entry[1]:
+                entry[1][encoding] = body
+                self._size += len(body)
+                self._trim()
+
+    def _trim(self):
+        while self._size > self.max_bytes and self._entries:
+            _, (_, bodies) = self._entries.popitem(last=False)
+            self._size -= sum(map(len, bodies.values()))
@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import GROUPINGS
+from benchmark import synthetic_sales
+from datastore import apply_schema, prepare_dataset
+
+NEW_PRODUCT_LINE = 'Sports and travel'
+
+
+def prepared(raw):
+    return prepare_dataset(apply_schema(raw))
+
+
+def csv_upload(raw, name='batch.csv'):
+    return {'file': (io.BytesIO(raw.to_csv(index=False).encode()), name)}
+
+
+def assert_cubes_equal(left, right):
+    for keys in GROUPINGS:
+        expected = right.table(keys)
+        assert len(left.table(keys)) == len(expected), keys
+        actual = left.table(keys).reindex(index=expected.index, columns=expected.columns)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_index_type=False, rtol=1e-9)
+
+
+def assert_moments_equal(left, right):
+    # Constant columns leave scatter entries that are rounding noise around zero
+    assert left.count == right.count
+    np.testing.assert_allclose(left.mean, right.mean, rtol=1e-12)
+    np.testing.assert_allclose(left.scatter, right.scatter, rtol=1e-9, atol=1e-9 * right.scatter.max())
+
+
+@pytest.fixture
+def raw_batches():
+    # Two batches of source rows; the second brings a product line and a month the first has never seen
+    old = synthetic_sales(400, seed=1)
+    old = old[(old['Product line'] != NEW_PRODUCT_LINE) & ~old['Date'].str.startswith('03/')]
+    return old.reset_index(drop=True), synthetic_sales(150, seed=2)
+
+
+@pytest.fixture
+def batches(raw_batches):
+    return tuple(map(prepared, raw_batches))
+
+
+@pytest.fixture
+def client():
+    # The app serving a small synthetic dataset; models fitted on it are kept in memory only
+    import app
+    app.data.model_path = None
+    app.set_dataset(apply_schema(synthetic_sales(500)))
+    app.page_cache.clear()
+    return app.app.test_client()
@@ -0,0 +1,407 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Third-party modules whose import cost the lazy context defers
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'seaborn', 'sklearn']
+
+# Filtered views kept for reuse
+MAX_VIEWS = int(os.environ.get('FILTERED_VIEWS_KEPT', 8))
+
+
+class FiltersUnavailable(ValueError):
+    pass
+
+
+class InvalidFilters(ValueError):
+    pass
+
+
+class DataView:
+    # A subset of the dataset, read by the charts through the same dataset and cube attributes as the full context
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self._cube = None
+        self._correlations = None
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    @property
+    def cube(self):
+        if self._cube is None:
+            from aggregates import build_cube
+            self._cube = build_cube(self.dataset)
+        return self._cube
+
+    @property
+    def correlations(self):
+        if self._correlations is None:
+            from correlations import correlation_moments
+            self._correlations = correlation_moments(self.dataset)
+        return self._correlations
+
+
+class StoreView(DataView):
+    # The rows of the shared store that match filters, as of one batch: the cube is summed by SQLite and the
+    # correlations from chunks of rows, and the rows themselves are only read when a chart needs them
+
+    def __init__(self, store, filters, seq):
+        super().__init__(None)
+        self.store = store
+        self.filters = filters
+        self.seq = seq
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            self._dataset = self.store.rows(upto=self.seq, filters=self.filters)
+        return self._dataset
+
+    @property
+    def cube(self):
+        if self._cube is None:
+            from aggregates import GROUPINGS
+            self._cube = self.store.cube(GROUPINGS, self.filters, upto=self.seq)
+        return self._cube
+
+    @property
+    def correlations(self):
+        if self._correlations is None:
+            from correlations import correlation_moments
+            self._correlations = _merged(map(correlation_moments,
+                                             self.store.chunks(upto=self.seq, filters=self.filters)))
+        return self._correlations
+
+
+def _merged(parts):
+    merged = None
+    for part in parts:
+        merged = part if merged is None else merged.merge(part)
+    return merged
+
+
+class DataContext:
+    # Dataset-derived state, each piece built on first use and shared by every request
+
+    def __init__(self, csv_path, model_path=None, use_cache=True, chunked=False, workers=None, db_path=None):
+        self.csv_path = csv_path
+        self.model_path = model_path
+        self.use_cache = use_cache
+        # Chunked mode scans a history larger than memory: the cube covers every row, while the charts and
+        # model that need raw rows see a bounded uniform sample of them
+        self.chunked = chunked
+        self.workers = workers
+        # With a database path the rows live in a SQLite file shared by every worker process: the cube and
+        # version come from SQL, and the rows are only read into memory when a chart or the model needs them
+        self.db_path = db_path
+        self.load_report = None
+        self._lock = threading.RLock()
+        self._values = {}
+        self._seconds = {}
+
+    def _get(self, name, build):
+        values = self._values
+        if name not in values:
+            with self._lock:
+                values = self._values
+                if name not in values:
+                    start = time.perf_counter()
+                    values[name] = build()
+                    self._seconds[name] = time.perf_counter() - start
+        return values[name]
+
+    @property
+    def dataset(self):
+        return self._get('dataset', self._load_dataset)
+
+    @property
+    def version(self):
+        return self._get('version', self._fingerprint)
+
+    @property
+    def cube(self):
+        return self._get('cube', self._build_cube)
+
+    @property
+    def correlations(self):
+        return self._get('correlations', self._build_correlations)
+
+    @property
+    def store(self):
+        if self.db_path is None:
+            return None
+        return self._get('store', self._open_store)
+
+    def _open_store(self):
+        from sql_store import SalesStore
+        return SalesStore(self.db_path).ensure(self.csv_path)
+
+    def _snapshot(self):
+        return self._get('snapshot', self.store.snapshot)
+
+    @property
+    def sales_model(self):
+        return self._get('sales_model', self._train_sales_model)
+
+    @property
+    def row_index(self):
+        return self._get('row_index', self._build_row_index)
+
+    def _scan(self):
+        from chunked import scan_sales
+        from datastore import LoadReport
+        scanned = scan_sales(self.csv_path, workers=self.workers)
+        self.load_report = LoadReport(self.csv_path, scanned.rows, None, None)
+        return scanned
+
+    def _load_dataset(self):
+        from datastore import FrozenFrame, LoadReport, load_sales, prepare_dataset
+        if self.store is not None:
+            dataset = self.store.rows(upto=self._snapshot().seq)
+            self.load_report = LoadReport(self.db_path, len(dataset), None, None)
+            return dataset
+        if self.chunked:
+            return FrozenFrame(self._get('scan', self._scan).sample)
+        raw, self.load_report = load_sales(self.csv_path, use_cache=self.use_cache)
+        return prepare_dataset(raw)
+
+    def _fingerprint(self):
+        from datastore import dataset_fingerprint
+        if self.store is not None:
+            return self._snapshot().version
+        if self.chunked:
+            # Over every scanned row; the sample alone would miss edits to the rows it left out
+            return self._get('scan', self._scan).version
+        return dataset_fingerprint(self.dataset)
+
+    def _build_cube(self):
+        from aggregates import build_cube
+        if self.store is not None:
+            return self._snapshot().cube
+        if self.chunked:
+            return self._get('scan', self._scan).cube
+        return build_cube(self.dataset)
+
+    def _build_correlations(self):
+        from correlations import correlation_moments
+        if self.chunked:
+            return self._get('scan', self._scan).correlations
+        if self.store is not None and not self.loaded('dataset'):
+            return self._store_view(()).correlations
+        return correlation_moments(self.dataset)
+
+    def _store_view(self, filters):
+        return StoreView(self.store, filters, self._snapshot().seq)
+
+    def _build_row_index(self):
+        from row_index import RowIndex
+        return RowIndex(self.dataset)
+
+    def _check_filterable(self):
+        # Chunked mode only holds a sample of the rows, and sums over the matching sample rows are no totals
+        if self.chunked:
+            raise FiltersUnavailable('Filters are not available with DATASET_MODE=chunked, where only a sample of '
+                                     'the rows is in memory')
+
+    def filter_options(self):
+        # Values offered for each filter dimension; none when filters are not available
+        if self.chunked:
+            return {}
+        if self.store is not None:
+            return self.store.options()
+        return self.row_index.options()
+
+    def matches(self, filters):
+        # Number of rows the filters select
+        self._check_filterable()
+        if self.store is not None:
+            return self.store.count(filters, upto=self._snapshot().seq)
+        return self.row_index.count(filters)
+
+    def row_count(self):
+        if self.store is not None and not self.loaded('dataset'):
+            return self.matches(())
+        return len(self.dataset)
+
+    def filtered(self, filters):
+        # Rows matching the filters, resolved through the bitmap index rather than by scanning the frame, or
+        # with a store, through SQL over its indexes. Recent views are kept, so the charts and explanations of
+        # one selection share a view and its cube.
+        from datastore import FrozenFrame
+        self._check_filterable()
+        views = self._get('views', OrderedDict)
+        with self._lock:
+            if filters in views:
+                views.move_to_end(filters)
+                return views[filters]
+        if self.store is not None:
+            view = self._store_view(filters)
+        else:
+            view = DataView(FrozenFrame(self.dataset.iloc[self.row_index.positions(filters)]))
+        with self._lock:
+            views[filters] = view
+            while len(views) > MAX_VIEWS:
+                views.popitem(last=False)
+        return view
+
+    def _training_moments(self):
+        # Fingerprint of the rows the sales model learns from, and a function giving their train and test
+        # moments. In chunked mode those are every scanned row, not the sample. With a store the moments are
+        # summed a chunk of rows at a time, and the store version stands in for the fingerprint.
+        from sales_model import split_moments, training_fingerprint
+        if self.chunked:
+            scan = self._get('scan', self._scan)
+            return scan.trained_on, lambda: (scan.train, scan.test)
+        if self.store is not None:
+            snapshot = self._snapshot()
+            if self.loaded('dataset'):
+                dataset = self.dataset
+                return snapshot.version, lambda: split_moments(dataset)
+
+            def moments():
+                splits = [split_moments(chunk) for chunk in self.store.chunks(upto=snapshot.seq)]
+                return _merged(train for train, _ in splits), _merged(test for _, test in splits)
+            return snapshot.version, moments
+        dataset = self.dataset
+        return training_fingerprint(dataset), lambda: split_moments(dataset)
+
+    def training_set(self):
+        # What model_search fits on: the fingerprint and moments the server trains under, so the model it
+        # publishes is the one running workers adopt, and rows to fit estimators on. In chunked mode those
+        # rows are the sample, while the moments still cover every scanned row.
+        fingerprint, moments = self._training_moments()
+        return fingerprint, moments, self.dataset
+
+    def _train_sales_model(self):
+        from sales_model import SalesModelRegistry
+        registry = SalesModelRegistry(self.model_path)
+        registry.ensure_fitted(*self._training_moments())
+        return registry
+
+    def retrain_sales_model(self):
+        return self.sales_model.refit(*self._training_moments())
+
+    def inputs_version(self, inputs):
+        # Content version of the data a chart reads: whole-dataset charts follow the dataset version,
+        # cube-backed charts only change when one of their cube tables does
+        if inputs == 'rows':
+            return self.version
+        versions = self._get('input_versions', dict)
+        if inputs not in versions:
+            import pandas as pd
+            cube = self.cube
+            digest = hashlib.sha1()
+            for keys in inputs:
+                digest.update(pd.util.hash_pandas_object(cube.table(keys)).values.tobytes())
+            versions[inputs] = digest.hexdigest()
+        return versions[inputs]
+
+    def loaded(self, name):
+        return name in self._values
+
+    def preload(self):
+        # Build everything up front, e.g. before a pre-fork server copies the process into its workers
+        for name in ('dataset', 'version', 'cube', 'correlations', 'sales_model'):
+            getattr(self, name)
+
+    def replace(self, frame):
+        # Swap in a new dataset; derived values are rebuilt lazily from it, the model is refit eagerly
+        from datastore import prepare_dataset
+        prepared = prepare_dataset(frame)
+        with self._lock:
+            sales_model = self._values.get('sales_model')
+            values = {'dataset': prepared}
+            if sales_model is not None:
+                sales_model.ensure(prepared)
+                values['sales_model'] = sales_model
+            # A replacement frame is already in memory, so its cube is built from it rather than by a rescan
+            self.chunked = False
+            self.db_path = None
+            self._values = values
+            self._seconds = {name: seconds for name, seconds in self._seconds.items() if name in values}
+
+    def append(self, new_rows):
+        # Fold a validated batch into the dataset; aggregates and the version are updated from the new rows only
+        from datastore import chained_fingerprint, prepare_dataset
+        prepared = prepare_dataset(new_rows)
+        if self.store is not None:
+            # Stored first, then picked up like a batch another worker stored; a batch stored before is skipped
+            if not self.store.append(prepared, chained_fingerprint):
+                return 0
+            self.sync()
+            return len(prepared)
+        with self._lock:
+            self._merge_rows(prepared, chained_fingerprint(self.version, prepared))
+        return len(prepared)
+
+    def sync(self):
+        # Fold in the batches other workers added to the shared store since this process last looked. A process
+        # that has not opened the store yet has nothing to fold in, and reads every batch when it does.
+        if not self.loaded('store'):
+            return False
+        store = self.store
+        with self._lock:
+            seq, latest = self._snapshot().seq, store.latest()
+            if latest == seq:
+                return False
+            self._merge_rows(store.rows(after=seq, upto=latest), store.batch_version(latest), seq=latest)
+        return True
+
+    def _merge_rows(self, prepared, version, seq=None):
+        # With a store, rows and correlations are only updated if already loaded; otherwise they are read when
+        # first needed, from a store that already holds the new rows
+        from aggregates import build_cube
+        from correlations import correlation_moments
+        from datastore import append_rows
+        loaded = self._values
+        cube = self.cube.merge(build_cube(prepared))
+        values = {'version': version, 'cube': cube}
+        if seq is not None:
+            from sql_store import StoreSnapshot
+            values['store'], values['snapshot'] = loaded['store'], StoreSnapshot(version, seq, cube)
+        if 'dataset' in loaded or seq is None:
+            values['dataset'] = append_rows(self.dataset, prepared)
+        if 'correlations' in loaded or seq is None:
+            values['correlations'] = self.correlations.merge(correlation_moments(prepared))
+        scan = loaded.get('scan')
+        if scan is not None:
+            # A retrain in chunked mode reads the scan's moments, so they take in the new rows too, under the
+            # fingerprint chain the model's own update uses
+            from sales_model import split_moments, training_fingerprint
+            train, test = split_moments(prepared)
+            trained_on = hashlib.sha1(f'{scan.trained_on}+{training_fingerprint(prepared)}'.encode()).hexdigest()
+            values['scan'] = scan._replace(cube=cube, correlations=values['correlations'],
+                                           train=scan.train.merge(train), test=scan.test.merge(test),
+                                           trained_on=trained_on, rows=scan.rows + len(prepared), version=version)
+        sales_model = loaded.get('sales_model')
+        if sales_model is not None:
+            sales_model.update(prepared)
+            values['sales_model'] = sales_model
+        self._values = values
+        self._seconds = {name: seconds for name, seconds in self._seconds.items() if name in values}
+
+    def status(self):
+        values = self._values
+        report = self.load_report
+        return {
+            'loaded': {name: name in values for name in ('dataset', 'version', 'cube', 'correlations', 'sales_model')},
+            'seconds': {name: round(seconds, 4) for name, seconds in self._seconds.items()},
+            'rows': len(values['dataset']) if 'dataset' in values else None,
+            'load_report': report._asdict() if report is not None else None,
+            'modules': {name: name in sys.modules for name in HEAVY_MODULES},
+        }
+
+
+data = DataContext(os.environ.get('DATASET_PATH', 'supermarket_sales.csv'),
+                   model_path=os.environ.get('SALES_MODEL_PATH', 'sales_model.pkl'),
+                   use_cache=os.environ.get('DATASET_CACHE', '1') == '1',
+                   chunked=os.environ.get('DATASET_MODE') == 'chunked',
+                   workers=int(os.environ.get('DATASET_WORKERS', 0)) or None,
+                   db_path=(os.environ.get('DATASET_DB', 'supermarket_sales.sqlite')
+                            if os.environ.get('DATASET_BACKEND') == 'sqlite' else None))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from datastore import NUMERIC_COLUMNS
+from moments import Moments
+
+# Columns whose values get a correlation matrix of their own, next to the one over every row
+SEGMENTS = ('Branch', 'Product line')
+
+
+class CorrelationMoments:
+    # Moments of the numeric columns over every row and per value of each segment column. They merge
+    # exactly, so appended batches, chunks and workers each contribute moments of their own rows, and
+    # any matrix is read back in O(columns²) however many rows went in.
+
+    def __init__(self, overall, segments, columns=tuple(NUMERIC_COLUMNS)):
+        self.overall = overall
+        self.segments = segments
+        self.columns = columns
+
+    def merge(self, other):
+        segments = {}
+        for column in dict.fromkeys([*self.segments, *other.segments]):
+            merged = dict(self.segments.get(column, {}))
+            for value, moments in other.segments.get(column, {}).items():
+                merged[value] = merged[value].merge(moments) if value in merged else moments
+            segments[column] = merged
+        return CorrelationMoments(self.overall.merge(other.overall), segments, self.columns)
+
+    def moments(self, segment=None, value=None):
+        if segment is None:
+            return self.overall
+        return self.segments[segment][value]
+
+    def frame(self, statistic='correlation', segment=None, value=None):
+        matrix = getattr(self.moments(segment, value), statistic)
+        return pd.DataFrame(matrix, index=list(self.columns), columns=list(self.columns))
+
+
+def correlation_moments(dataset, segments=SEGMENTS, columns=tuple(NUMERIC_COLUMNS)):
+    values = dataset[list(columns)].to_numpy(dtype=float)
+    by_segment = {}
+    for column in segments:
+        codes, labels = pd.factorize(dataset[column], sort=True)
+        # One stable sort per segment column puts each value's rows next to each other
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+        by_segment[column] = {str(label): Moments.of(values[order[bounds[i]:bounds[i + 1]]])
+                              for i, label in enumerate(labels)}
+    return CorrelationMoments(Moments.of(values), by_segment, tuple(columns))
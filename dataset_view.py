@@ -0,0 +1,154 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from datastore import SOURCE_COLUMNS
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 1000
+STREAM_CHUNK_ROWS = 5000
+
+ViewQuery = namedtuple('ViewQuery', ['columns', 'filters', 'sort', 'ascending', 'page', 'per_page'])
+
+# Sort permutations are computed once per (dataset version, column) and shared by every page request
+_sort_orders = {}
+_sort_lock = threading.Lock()
+
+
+def parse_view_query(args, dataset, paginate=True):
+    # The derived calendar keys stay internal unless asked for by name
+    columns = [c for c in args.get('columns', '').split(',') if c] or list(SOURCE_COLUMNS)
+    filters = []
+    for raw in args.getlist('filter'):
+        column, sep, value = raw.partition(':')
+        if not sep:
+            raise ValueError(f'Filters look like Column:value, got {raw!r}')
+        filters.append((column, value))
+    sort = args.get('sort') or None
+    unknown = [c for c in columns + [c for c, _ in filters] + ([sort] if sort else []) if c not in dataset.columns]
+    if unknown:
+        raise ValueError(f'Unknown columns: {", ".join(unknown)}')
+
+    ascending = args.get('order', 'asc') != 'desc'
+    if paginate or 'page' in args:
+        page = max(args.get('page', 1, type=int), 1)
+        per_page = min(max(args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    else:
+        page, per_page = None, None
+    return ViewQuery(columns, filters, sort, ascending, page, per_page)
+
+
+def _filter_mask(dataset, filters):
+    mask = np.ones(len(dataset), dtype=bool)
+    for column, value in filters:
+        values = dataset[column]
+        if pd.api.types.is_numeric_dtype(values):
+            try:
+                mask &= (values == float(value)).to_numpy()
+            except ValueError:
+                raise ValueError(f'{column} filter needs a number, got {value!r}')
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            # Compared as category codes, so no label is built per row
+            code = values.cat.categories.get_indexer([value])[0]
+            if code < 0:
+                mask[:] = False
+            else:
+                mask &= values.cat.codes.to_numpy() == code
+        elif pd.api.types.is_string_dtype(values):
+            mask &= values.eq(value).to_numpy(dtype=bool, na_value=False)
+        else:
+            mask &= (values.astype(str) == value).to_numpy()
+    return mask
+
+
+def _sort_order(dataset, column, version):
+    key = (version, column)
+    with _sort_lock:
+        order = _sort_orders.get(key)
+    if order is None:
+        order = np.argsort(dataset[column].to_numpy(), kind='stable')
+        with _sort_lock:
+            # Orders from an older dataset version are never asked for again
+            for stale in [k for k in _sort_orders if k[0] != version]:
+                del _sort_orders[stale]
+            _sort_orders[key] = order
+    return order
+
+
+def select_rows(dataset, query, version):
+    # Row positions matching the query, in display order. Without a sort or filter that is a range, so a
+    # page of the unsorted dataset allocates only the page itself.
+    mask = _filter_mask(dataset, query.filters) if query.filters else None
+    if query.sort:
+        positions = _sort_order(dataset, query.sort, version)
+        if not query.ascending:
+            positions = positions[::-1]
+        if mask is not None:
+            positions = positions[mask[positions]]
+    elif mask is not None:
+        positions = np.flatnonzero(mask)
+    else:
+        positions = range(len(dataset))
+    return positions
+
+
+def page_of(positions, query):
+    if query.page is None:
+        return positions
+    start = (query.page - 1) * query.per_page
+    return positions[start:start + query.per_page]
+
+
+def iter_row_chunks(dataset, positions, columns, chunk_rows=STREAM_CHUNK_ROWS):
+    for start in range(0, len(positions), chunk_rows):
+        yield dataset.iloc[positions[start:start + chunk_rows]][columns]
+
+
+def _calendar_text(chunk):
+    # Dates, times of day and periods as they read in the CSV, e.g. 2019-02-06 and 16:01
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        values = chunk[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            chunk[column] = values.dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_timedelta64_dtype(values):
+            minutes = values // pd.Timedelta(minutes=1)
+            chunk[column] = (minutes // 60).map('{:02d}'.format) + ':' + (minutes % 60).map('{:02d}'.format)
+        elif isinstance(values.dtype, pd.PeriodDtype):
+            chunk[column] = values.astype(str)
+    return chunk
+
+
+def _display(chunk):
+    chunk = _calendar_text(chunk)
+    floats = [c for c in chunk.columns if pd.api.types.is_float_dtype(chunk[c])]
+    return chunk.round({c: 6 for c in floats}).astype(str)
+
+
+def html_rows(chunks):
+    for chunk in chunks:
+        yield from _display(chunk).itertuples(index=False, name=None)
+
+
+def _jsonable(chunk):
+    # Same text as the HTML view; the JSON writer would send ISO timestamps and durations, and has no
+    # encoding for Period values at all
+    return _calendar_text(chunk)
+
+
+def ndjson_lines(chunks):
+    for chunk in chunks:
+        yield _jsonable(chunk).to_json(orient='records', lines=True)
+
+
+def json_array(chunks):
+    yield '['
+    first = True
+    for chunk in chunks:
+        body = _jsonable(chunk).to_json(orient='records')[1:-1]
+        if body:
+            yield body if first else ',' + body
+            first = False
+    yield ']'
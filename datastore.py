@@ -0,0 +1,249 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Parquet needs pyarrow; without it the typed cache falls back to pandas' pickle format
+CACHE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pickle'
+
+logger = logging.getLogger(__name__)
+
+# Numeric measures as they appear in supermarket_sales.csv; derived calendar keys are not measures
+NUMERIC_COLUMNS = ['Unit price', 'Quantity', 'Tax 5%', 'Total', 'cogs', 'gross margin percentage', 'gross income',
+                   'Rating']
+CALENDAR_COLUMNS = ['Month', 'Week', 'Weekday', 'Hour']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Explicit schema for the low-cardinality labels and the numerics that fit a narrower type.
+# Decimal columns stay float64: sums over millions of rows remain exact to the cent, and values such as a
+# 9.3 rating are served as 9.3 rather than float32's 9.3000001907.
+SOURCE_COLUMNS = ['Invoice ID', 'Branch', 'City', 'Customer type', 'Gender', 'Product line', 'Unit price', 'Quantity',
+                  'Tax 5%', 'Total', 'Date', 'Time', 'Payment', 'cogs', 'gross margin percentage', 'gross income',
+                  'Rating']
+CATEGORY_COLUMNS = ['Branch', 'City', 'Customer type', 'Gender', 'Product line', 'Payment']
+DOWNCAST_COLUMNS = {'Quantity': 'int16'}
+# Part of the typed cache's metadata; a cache written under another schema is rebuilt from the CSV
+SCHEMA_VERSION = 2
+
+LoadReport = namedtuple('LoadReport', ['source', 'rows', 'memory_before', 'memory_after'])
+
+
+class _ReadOnlyIndexer:
+    def __init__(self, indexer):
+        self._indexer = indexer
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value):
+        raise TypeError('The shared dataset is read-only; work on a .copy() instead')
+
+
+class FrozenFrame(pd.DataFrame):
+    # The prepared dataset shared by every request: reads work as usual, writes raise
+
+    @property
+    def _constructor(self):
+        # Anything derived from the shared frame is an ordinary, writable DataFrame
+        return pd.DataFrame
+
+    def __setitem__(self, key, value):
+        raise TypeError('The shared dataset is read-only; work on a .copy() instead')
+
+    def __delitem__(self, key):
+        raise TypeError('The shared dataset is read-only; work on a .copy() instead')
+
+    def insert(self, *args, **kwargs):
+        raise TypeError('The shared dataset is read-only; work on a .copy() instead')
+
+    def pop(self, *args, **kwargs):
+        raise TypeError('The shared dataset is read-only; work on a .copy() instead')
+
+    @property
+    def loc(self):
+        return _ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return _ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return _ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return _ReadOnlyIndexer(super().iat)
+
+
+def _parse_calendar(frame):
+    if not pd.api.types.is_datetime64_any_dtype(frame['Date']):
+        frame['Date'] = pd.to_datetime(frame['Date'], format='%m/%d/%Y')
+    if not pd.api.types.is_timedelta64_dtype(frame['Time']):
+        times = frame['Time'].astype(str)
+        frame['Time'] = pd.to_timedelta(times.where(times.str.count(':') > 1, times + ':00'))
+    return frame
+
+
+def _check_downcast(raw):
+    # astype wraps values outside the narrower type and truncates fractions without a word
+    for column, dtype in DOWNCAST_COLUMNS.items():
+        values = pd.to_numeric(raw[column]).dropna()
+        limits = np.iinfo(dtype)
+        if not ((values % 1 == 0) & values.between(limits.min, limits.max)).all():
+            raise ValueError(f'{column} must be whole numbers from {limits.min} to {limits.max}')
+
+
+def apply_schema(raw):
+    _check_downcast(raw)
+    frame = raw.astype({**{column: 'category' for column in CATEGORY_COLUMNS}, **DOWNCAST_COLUMNS})
+    return _parse_calendar(frame)
+
+
+def _memory(frame):
+    return int(frame.memory_usage(deep=True).sum())
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(csv_path):
+    stem = os.path.splitext(csv_path)[0]
+    return f'{stem}.{CACHE_FORMAT}', f'{stem}.cache.json'
+
+
+def _read_cache(csv_path):
+    data_path, meta_path = _cache_paths(csv_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if (meta.get('format'), meta.get('schema')) != (CACHE_FORMAT, SCHEMA_VERSION) or not os.path.exists(data_path):
+        return None, None
+
+    stat = os.stat(csv_path)
+    if (meta.get('mtime_ns'), meta.get('size')) != (stat.st_mtime_ns, stat.st_size):
+        # A touched but unchanged CSV can still use the cache
+        if meta.get('sha1') != file_sha1(csv_path):
+            return None, None
+        meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _write_meta(meta_path, meta)
+
+    if CACHE_FORMAT == 'parquet':
+        frame = pd.read_parquet(data_path)
+    else:
+        frame = pd.read_pickle(data_path)
+    return frame, meta
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = f'{meta_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _write_cache(csv_path, frame, meta):
+    data_path, meta_path = _cache_paths(csv_path)
+    tmp_path = f'{data_path}.tmp'
+    if CACHE_FORMAT == 'parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_pickle(tmp_path)
+    os.replace(tmp_path, data_path)
+    _write_meta(meta_path, meta)
+
+
+def load_sales(csv_path, use_cache=True):
+    # Typed load of the sales CSV, reusing a binary cache beside it while the CSV is unchanged
+    if use_cache:
+        frame, meta = _read_cache(csv_path)
+        if frame is not None:
+            report = LoadReport(_cache_paths(csv_path)[0], len(frame), meta['memory_before'], _memory(frame))
+            logger.info('Loaded %d rows from %s (%.1f MB, %.1f MB as raw CSV)', report.rows, report.source,
+                        report.memory_after / 1e6, report.memory_before / 1e6)
+            return frame, report
+
+    stat = os.stat(csv_path)
+    raw = pd.read_csv(csv_path)
+    memory_before = _memory(raw)
+    frame = apply_schema(raw)
+    del raw
+    report = LoadReport(csv_path, len(frame), memory_before, _memory(frame))
+    logger.info('Loaded %d rows from %s: %.1f MB as parsed, %.1f MB typed', report.rows, csv_path,
+                report.memory_before / 1e6, report.memory_after / 1e6)
+
+    if use_cache:
+        meta = {'format': CACHE_FORMAT, 'schema': SCHEMA_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                'sha1': file_sha1(csv_path), 'memory_before': memory_before}
+        try:
+            _write_cache(csv_path, frame, meta)
+        except OSError as e:
+            logger.warning('Could not write the dataset cache for %s: %s', csv_path, e)
+    return frame, report
+
+
+def validate_rows(raw):
+    # Check a batch of new sales rows against the CSV schema and return it typed like the loaded dataset
+    missing = [column for column in SOURCE_COLUMNS if column not in raw.columns]
+    if missing:
+        raise ValueError(f'Missing columns: {", ".join(missing)}')
+    raw = raw[SOURCE_COLUMNS]
+    try:
+        raw = raw.astype({column: float for column in NUMERIC_COLUMNS if column not in DOWNCAST_COLUMNS})
+        frame = apply_schema(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Rows do not match the sales schema: {e}')
+    incomplete = frame.columns[frame.isna().any()].tolist()
+    if incomplete:
+        raise ValueError(f'Missing values in: {", ".join(incomplete)}')
+    return frame
+
+
+def append_rows(dataset, new_rows):
+    # Category dtypes must agree before concatenating, or pandas silently falls back to plain strings
+    dtypes = {}
+    for column in CATEGORY_COLUMNS:
+        old, new = dataset[column].dtype, new_rows[column].dtype
+        if not new.categories.isin(old.categories).all():
+            old = pd.CategoricalDtype(old.categories.union(new.categories))
+            dtypes[column] = old
+        new_rows = new_rows.astype({column: old})
+    if dtypes:
+        dataset = dataset.astype(dtypes)
+    return FrozenFrame(pd.concat([dataset, new_rows], ignore_index=True))
+
+
+def chained_fingerprint(version, new_rows):
+    # Version after an append, derived from the old version and the new rows only
+    return hashlib.sha1(f'{version}+{dataset_fingerprint(new_rows)}'.encode()).hexdigest()
+
+
+def dataset_fingerprint(dataset):
+    # Content hash of the whole frame, including column names, so any edit yields a new version
+    hashed = pd.util.hash_pandas_object(dataset, index=False)
+    digest = hashlib.sha1(hashed.values.tobytes())
+    digest.update('\x1f'.join(map(str, dataset.columns)).encode())
+    return digest.hexdigest()
+
+
+def prepare_dataset(raw):
+    # Parse dates and times once at load time and derive the calendar keys the charts group by
+    frame = _parse_calendar(pd.DataFrame(raw).copy())
+
+    frame['Month'] = frame['Date'].dt.to_period('M')
+    frame['Week'] = frame['Date'].dt.to_period('W')
+    frame['Weekday'] = pd.Categorical(frame['Date'].dt.day_name(), categories=WEEKDAYS, ordered=True)
+    frame['Hour'] = (frame['Time'] // pd.Timedelta(hours=1)).astype('int8')
+    return FrozenFrame(frame)
@@ -0,0 +1,285 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from jinja2 import DictLoader, Environment
+
+from analytics import aggregate_frame, records
+from context import data
+
+# One template per visualization type, rendered from the same series the chart plots (see analytics.SERIES)
+TEMPLATES = {
+    'product_distribution': '''
+<p>This plot shows how many sales each product line accounts for in the supermarket sales dataset. Each bar
+represents a product line, and its height is the number of sales of that product line.</p>
+{% set ranked = rows | sort(attribute='count', reverse=True) %}
+<ul>
+{% for row in ranked %}
+    <li>'{{ row['Product line'] }}': {{ row['count'] | units }} sales</li>
+{% endfor %}
+</ul>
+<p>'{{ ranked[0]['Product line'] }}' is the most frequently sold product line and '{{ ranked[-1]['Product line'] }}'
+the least.</p>
+<p>Overall, this visualization shows the popularity of the different product lines in the supermarket.</p>
+''',
+    'profitability': '''
+<p>Total profitability by product line shows how much gross income each product category contributes to the
+overall profitability of the company.</p>
+<ul>
+{% for row in rows | sort(attribute='gross income', reverse=True) %}
+    <li><strong>{{ row['Product line'] }}:</strong> {{ row['gross income'] | money }} in gross income.</li>
+{% endfor %}
+</ul>
+<p>Identifying the most and least profitable lines helps allocate resources, optimize the product mix and focus
+marketing where it pays off.</p>
+''',
+    'revenue': '''
+<p>Total revenue by product line shows the revenue-generating potential of each product category.</p>
+<ul>
+{% for row in rows | sort(attribute='Total', reverse=True) %}
+    <li><strong>{{ row['Product line'] }}:</strong> {{ row['Total'] | money }} in total revenue.</li>
+{% endfor %}
+</ul>
+''',
+    'sales_volume': '''
+{% set ranked = rows | sort(attribute='Quantity', reverse=True) %}
+<p>{{ ranked[0]['Product line'] }} has the highest total sales volume, with {{ ranked[0]['Quantity'] | units }}
+units sold, while {{ ranked[-1]['Product line'] }} has the lowest, with {{ ranked[-1]['Quantity'] | units }} units.</p>
+<ul>
+{% for row in ranked %}
+    <li><strong>{{ row['Product line'] }}:</strong> {{ row['Quantity'] | units }} units</li>
+{% endfor %}
+</ul>
+<p>Sales volume by product line shows which categories are in higher demand, which can guide marketing, inventory
+and product decisions.</p>
+''',
+    'sales_volume_by_gender': '''
+{% from '_macros' import gender_table %}
+<p>Average number of units per sale for each product line, split by customer gender:</p>
+{{ gender_table(rows) }}
+''',
+    'gross_income_by_gender': '''
+{% from '_macros' import gender_table %}
+<p>This plot compares male and female customers across the product lines, by the average number of units per
+sale:</p>
+{{ gender_table(rows) }}
+''',
+    'monthly_income': '''
+<p>Monthly gross income for each product line:</p>
+<table>
+  <tr>
+    <th>Month</th>
+{% for line in product_lines %}
+    <th>{{ line }}</th>
+{% endfor %}
+  </tr>
+{% for month, income in months.items() %}
+  <tr>
+    <td>{{ month }}</td>
+{% for line in product_lines %}
+    <td>{{ income[line] | money if line in income else '' }}</td>
+{% endfor %}
+  </tr>
+{% endfor %}
+</table>
+''',
+    'monthly_gross_income': '''
+<p>Monthly gross income across all branches and product lines:</p>
+<table>
+  <tr>
+    <th>Month</th>
+    <th>Gross Income</th>
+  </tr>
+{% for row in rows %}
+  <tr>
+    <td>{{ row['Month'] }}</td>
+    <td>{{ row['gross income'] | money }}</td>
+  </tr>
+{% endfor %}
+</table>
+{% set best = rows | sort(attribute='gross income') | last %}
+<p>Gross income peaked in {{ best['Month'] }} at {{ best['gross income'] | money }}. Following the monthly
+fluctuations helps with financial planning and spotting seasonal trends.</p>
+''',
+    'total_gross_income_by_branch': '''
+<p>Total gross income for each branch:</p>
+<table>
+  <tr>
+    <th>Branch</th>
+    <th>Gross Income</th>
+  </tr>
+{% for row in rows %}
+  <tr>
+    <td>{{ row['Branch'] }}</td>
+    <td>{{ row['gross income'] | money }}</td>
+  </tr>
+{% endfor %}
+</table>
+{% set ranked = rows | sort(attribute='gross income', reverse=True) %}
+<p>Branch {{ ranked[0]['Branch'] }} has the highest total gross income{% if ranked | length > 1 %}, and branch
+{{ ranked[-1]['Branch'] }} the lowest{% endif %}. Comparing branches helps evaluate their performance and allocate
+resources.</p>
+''',
+    'average_ratings_by_product_lines': '''
+<p>Average customer rating for each product line:</p>
+<table>
+  <tr>
+    <th>Product Line</th>
+    <th>Average Rating</th>
+  </tr>
+{% for row in rows %}
+  <tr>
+    <td>{{ row['Product line'] }}</td>
+    <td>{{ row['mean Rating'] | decimal }}</td>
+  </tr>
+{% endfor %}
+</table>
+{% set ranked = rows | sort(attribute='mean Rating', reverse=True) %}
+<p>{{ ranked[0]['Product line'] }} has the highest average rating, {{ ranked[0]['mean Rating'] | decimal }}, and
+{{ ranked[-1]['Product line'] }} the lowest, {{ ranked[-1]['mean Rating'] | decimal }}.</p>
+''',
+    'product_lines_gross_income': '''
+<p><strong>Gross Income by Product Line:</strong></p>
+<table>
+  <tr>
+    <th>Product Line</th>
+    <th>Gross Income ($)</th>
+  </tr>
+{% for row in rows | sort(attribute='gross income') %}
+  <tr>
+    <td>{{ row['Product line'] }}</td>
+    <td>{{ row['gross income'] | decimal }}</td>
+  </tr>
+{% endfor %}
+</table>
+<p><strong>Insights:</strong></p>
+<ol>
+{% for row in rows | sort(attribute='gross income', reverse=True) %}
+  <li><strong>{{ row['Product line'] }}:</strong> {{ row['gross income'] | money }}
+  ({{ (row['gross income'] / total) | percent }} of gross income)</li>
+{% endfor %}
+</ol>
+''',
+    'average_ratings_vs_sales_volume': '''
+<p>Average rating and units sold for each product line:</p>
+<table>
+  <tr>
+    <th>Product Line</th>
+    <th>Average Rating</th>
+    <th>Units Sold</th>
+  </tr>
+{% for row in rows | sort(attribute='mean Rating', reverse=True) %}
+  <tr>
+    <td>{{ row['Product line'] }}</td>
+    <td>{{ row['mean Rating'] | decimal }}</td>
+    <td>{{ row['Quantity'] | units }}</td>
+  </tr>
+{% endfor %}
+</table>
+<p>Across product lines, the correlation between average rating and units sold is {{ correlation | decimal }}.</p>
+''',
+    'cogs_and_gross_income': '''
+<p>Each point is one sale: its cost of goods sold against its gross income, with the fitted regression line and the
+distribution of each measure on the margins.</p>
+<p>Over {{ count | units }} sales, gross income is {{ ratio | percent }} of COGS on average, and the two are
+correlated at {{ correlation | decimal }}.</p>
+''',
+    'correlation_heatmap': '''
+<p>The heatmap shows the correlation between each pair of numeric columns in the dataset. The strongest
+relationships between different measures are:</p>
+<ul>
+{% for first, second, value in pairs %}
+  <li><strong>{{ first }} and {{ second }}:</strong> {{ value | decimal }}</li>
+{% endfor %}
+</ul>
+{% if constant %}
+<p>{{ constant | join(', ') }} never {{ 'varies' if constant | length == 1 else 'vary' }}, so {{ 'its' if constant | length == 1
+else 'their' }} correlations are undefined and left blank.</p>
+{% endif %}
+''',
+}
+
+GENDER_TABLE = '''
+{% macro gender_table(rows) %}
+<table>
+  <tr>
+    <th>Product Line</th>
+    <th>Gender</th>
+    <th>Average Units</th>
+    <th>Sales</th>
+  </tr>
+{% for row in rows %}
+  <tr>
+    <td>{{ row['Product line'] }}</td>
+    <td>{{ row['Gender'] }}</td>
+    <td>{{ row['mean Quantity'] | decimal }}</td>
+    <td>{{ row['count'] | units }}</td>
+  </tr>
+{% endfor %}
+</table>
+{% endmacro %}
+'''
+
+_environment = Environment(loader=DictLoader({**TEMPLATES, '_macros': GENDER_TABLE}), autoescape=True,
+                           trim_blocks=True, lstrip_blocks=True)
+_environment.filters.update({
+    'money': '${:,.2f}'.format,
+    'decimal': '{:.2f}'.format,
+    'percent': '{:.1%}'.format,
+    'units': '{:,.0f}'.format,
+})
+
+# Rendered explanations per (visualization type, version of the data the chart reads), least recently used
+# dropped first, since filtered charts add a version per filter combination
+MAX_EXPLANATIONS = 256
+_explanations = OrderedDict()
+_explanations_lock = threading.Lock()
+
+
+def _correlation(first, second):
+    # Undefined for fewer than two points, e.g. a chart filtered down to one product line
+    return first.corr(second) if len(first) > 1 else float('nan')
+
+
+def _context(visualization_type, frame):
+    rows = records(frame)
+    context = {'rows': rows}
+    if visualization_type == 'monthly_income':
+        context['product_lines'] = list(dict.fromkeys(row['Product line'] for row in rows))
+        context['months'] = {}
+        for row in rows:
+            context['months'].setdefault(row['Month'], {})[row['Product line']] = row['gross income']
+    elif visualization_type == 'product_lines_gross_income':
+        context['total'] = sum(row['gross income'] for row in rows)
+    elif visualization_type == 'average_ratings_vs_sales_volume':
+        context['correlation'] = _correlation(frame['mean Rating'], frame['Quantity'])
+    elif visualization_type == 'cogs_and_gross_income':
+        fit = rows[0]
+        context['count'] = fit['rows']
+        context['ratio'] = fit['mean gross income'] / fit['mean cogs']
+        context['correlation'] = fit['correlation']
+    elif visualization_type == 'correlation_heatmap':
+        matrix = frame.set_index('column')
+        upper = matrix.where(np.triu(np.ones(matrix.shape, dtype=bool), k=1)).stack().dropna()
+        strongest = upper.reindex(upper.abs().sort_values(ascending=False).index)
+        context['pairs'] = [(first, second, value) for (first, second), value in strongest.head(5).items()]
+        context['constant'] = [column for column in matrix.index if np.isnan(matrix.loc[column, column])]
+    return context
+
+
+def explain(visualization_type, version, filters=()):
+    # Regenerated only when the data the chart reads changes, so the text always matches the image
+    key = (visualization_type, version)
+    with _explanations_lock:
+        html = _explanations.get(key)
+        if html is not None:
+            _explanations.move_to_end(key)
+    if html is None:
+        source = data.filtered(filters) if filters else data
+        frame = aggregate_frame(visualization_type, source)
+        html = _environment.get_template(visualization_type).render(**_context(visualization_type, frame))
+        with _explanations_lock:
+            _explanations[key] = html
+            while len(_explanations) > MAX_EXPLANATIONS:
+                _explanations.popitem(last=False)
+    return html
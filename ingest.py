@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def read_batch(source):
+    import pandas as pd
+    from datastore import validate_rows
+    return validate_rows(pd.read_csv(source))
+
+
+class BatchDirectory:
+    # Append-only directory of ingested CSV batches. Every worker process replays it in name order,
+    # so batches uploaded to one worker reach all of them, and a restarted worker catches up.
+
+    def __init__(self, directory, ingest, interval=5.0):
+        self.directory = directory
+        self.ingest = ingest
+        self.interval = interval
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, payload):
+        # Called after this process already ingested the batch, so mark it seen before it becomes visible
+        name = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}.csv'
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            self._seen.add(name)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(f'{path}.tmp', path)
+        return name
+
+    def scan(self):
+        ingested = 0
+        with self._lock:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.endswith('.csv') and name not in self._seen)
+            for name in names:
+                # Mark first so a malformed batch is reported once instead of on every scan
+                self._seen.add(name)
+                try:
+                    ingested += self.ingest(read_batch(os.path.join(self.directory, name)))
+                except (OSError, ValueError) as e:
+                    logger.warning('Skipping sales batch %s: %s', name, e)
+        return ingested
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception:
+                logger.exception('Scanning %s for sales batches failed', self.directory)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='ingest-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
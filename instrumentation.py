@@ -0,0 +1,274 @@
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_sampler = None
+
+
+class Recorder:
+    # Per-stage timings of one request, or of one chart render on a pool worker. A stage's time and
+    # allocations exclude the stages nested in it, so the stages of a request add up to its total.
+    # Allocations are the net change in allocated memory blocks, which is process-wide: renders running
+    # on other threads at the same time are counted too.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.stacks = Counter()
+        self.labels = {}
+        self._open = []
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, blocks, nested_blocks=True):
+        totals = self.stages.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += blocks
+        if self._open:
+            self._open[-1][0] += seconds
+            if nested_blocks:
+                self._open[-1][1] += blocks
+
+    @contextmanager
+    def stage(self, name):
+        nested = [0.0, 0]
+        self._open.append(nested)
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            blocks = sys.getallocatedblocks() - blocks
+            self._open.pop()
+            self.add(name, seconds - nested[0], blocks - nested[1])
+
+    def sample(self, stack):
+        with self._lock:
+            self.stacks[stack] += 1
+
+    def snapshot(self):
+        # Plain, picklable copy, so process workers can send it back with the rendered chart
+        with self._lock:
+            return {'stages': {name: list(totals) for name, totals in self.stages.items()},
+                    'stacks': dict(self.stacks), 'pid': os.getpid()}
+
+    def merge(self, snapshot):
+        # Stages recorded elsewhere count as nested in the stage open here, e.g. the wait for a render worker.
+        # Allocations in another process never showed up in this one's block count, so only time is deducted.
+        same_process = snapshot['pid'] == os.getpid()
+        for name, (seconds, blocks) in snapshot['stages'].items():
+            self.add(name, seconds, blocks, nested_blocks=same_process)
+        with self._lock:
+            self.stacks.update(snapshot['stacks'])
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        metrics = [f'{name};dur={seconds * 1000:.2f};desc="{blocks:+d} blocks"'
+                   for name, (seconds, blocks) in self.stages.items()]
+        return ', '.join(metrics + [f'total;dur={self.elapsed() * 1000:.2f}'])
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+def begin():
+    recorder = Recorder()
+    _local.recorder = recorder
+    if _sampler is not None:
+        _sampler.register(recorder)
+    return recorder
+
+
+def end(recorder=None):
+    if recorder is not None and current() is not recorder:
+        return
+    _local.recorder = None
+    if _sampler is not None:
+        _sampler.unregister()
+
+
+@contextmanager
+def recording():
+    # For work outside a request, such as a chart render on a pool worker
+    previous = current()
+    try:
+        yield begin()
+    finally:
+        end()
+        if previous is not None:
+            _local.recorder = previous
+            if _sampler is not None:
+                _sampler.register(previous)
+
+
+@contextmanager
+def stage(name):
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(name):
+        yield
+
+
+def label(**labels):
+    recorder = current()
+    if recorder is not None:
+        recorder.labels.update(labels)
+
+
+def merge(snapshot):
+    recorder = current()
+    if recorder is not None:
+        recorder.merge(snapshot)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    # Process-wide totals in the Prometheus text format; under a pre-fork server every worker reports its own
+
+    LABELS = ('endpoint', 'chart')
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._requests = {}
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, recorder, endpoint):
+        key = (endpoint, recorder.labels.get('chart', ''))
+        seconds = recorder.elapsed()
+        with self._lock:
+            counts = self._requests.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += seconds
+            counts[-1] += 1
+            for name, (stage_seconds, blocks) in recorder.stages.items():
+                totals = self._stages.setdefault(key + (name,), [0.0, 0, 0])
+                totals[0] += stage_seconds
+                totals[1] += blocks
+                totals[2] += 1
+
+    def exposition(self):
+        with self._lock:
+            requests = {key: list(counts) for key, counts in self._requests.items()}
+            stages = {key: list(totals) for key, totals in self._stages.items()}
+
+        lines = ['# HELP sales_request_duration_seconds Request wall time, including streamed response bodies',
+                 '# TYPE sales_request_duration_seconds histogram']
+        for key, counts in sorted(requests.items()):
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'sales_request_duration_seconds_bucket{_labels(self.LABELS, key, le=bound)} {count}')
+            lines.append(f'sales_request_duration_seconds_bucket{_labels(self.LABELS, key, le="+Inf")} {counts[-1]}')
+            lines.append(f'sales_request_duration_seconds_sum{_labels(self.LABELS, key)} {counts[-2]!r}')
+            lines.append(f'sales_request_duration_seconds_count{_labels(self.LABELS, key)} {counts[-1]}')
+
+        names = self.LABELS + ('stage',)
+        lines += ['# HELP sales_stage_seconds Time per request in each stage, excluding nested stages',
+                  '# TYPE sales_stage_seconds summary']
+        for key, (seconds, _, count) in sorted(stages.items()):
+            lines.append(f'sales_stage_seconds_sum{_labels(names, key)} {seconds!r}')
+            lines.append(f'sales_stage_seconds_count{_labels(names, key)} {count}')
+        lines += ['# HELP sales_stage_allocated_blocks Net change in allocated memory blocks per request in each stage',
+                  '# TYPE sales_stage_allocated_blocks summary']
+        for key, (_, blocks, count) in sorted(stages.items()):
+            lines.append(f'sales_stage_allocated_blocks_sum{_labels(names, key)} {blocks}')
+            lines.append(f'sales_stage_allocated_blocks_count{_labels(names, key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _fold(frame):
+    # One line of Brendan Gregg's folded stack format, outermost frame first
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    # Samples the stacks of the threads that are recording at a fixed interval, so profiling costs the
+    # request threads nothing beyond the GIL handoffs
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, recorder):
+        self._threads[threading.get_ident()] = recorder
+        # Threads do not survive a fork, so each process, render workers included, starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='sampler', daemon=True).start()
+
+    def unregister(self):
+        self._threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, recorder in list(self._threads.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    recorder.sample(_fold(frame))
+
+
+def enable_sampling(interval):
+    global _sampler
+    _sampler = Sampler(interval)
+
+
+class SlowestProfiles:
+    # Keeps the folded stacks of the slowest sampled requests on disk, for flamegraph.pl or speedscope
+
+    def __init__(self, directory, keep=10):
+        self.directory = directory
+        self.keep = keep
+        self._slowest = []
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def offer(self, recorder, endpoint):
+        seconds = recorder.elapsed()
+        with self._lock:
+            if not recorder.stacks or (len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]):
+                return None
+            self._written += 1
+            name = '-'.join(filter(None, [f'{seconds * 1000:.0f}ms', endpoint, recorder.labels.get('chart')]))
+            path = os.path.join(self.directory,
+                                f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}-{os.getpid()}-{self._written}.folded")
+            with open(path, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in recorder.snapshot()['stacks'].items())
+            heapq.heappush(self._slowest, (seconds, path))
+            if len(self._slowest) > self.keep:
+                _, evicted = heapq.heappop(self._slowest)
+                os.remove(evicted)
+            return path
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.model_selection import KFold, ParameterGrid
+
+from sales_model import FEATURES, TARGET, SalesModelRegistry, holdout_mask, linear_model, training_fingerprint
+
+# Model family -> estimator and the parameter grid searched for it
+CANDIDATES = {
+    'linear': (LinearRegression, {}),
+    'ridge': (Ridge, {'alpha': [0.01, 0.1, 1.0, 10.0, 100.0]}),
+    'lasso': (Lasso, {'alpha': [0.001, 0.01, 0.1], 'max_iter': [10000]}),
+    'gradient_boosting': (GradientBoostingRegressor, {'n_estimators': [100, 300], 'max_depth': [2, 3],
+                                                      'learning_rate': [0.05, 0.1], 'random_state': [42]}),
+    'random_forest': (RandomForestRegressor, {'n_estimators': [200], 'min_samples_leaf': [1, 5],
+                                              'random_state': [42]}),
+}
+
+# Families whose fit is expressible as sufficient statistics, so the published model keeps updating online
+LINEAR_FAMILIES = {'linear', 'ridge'}
+
+
+def candidates(families=None):
+    for family in families or CANDIDATES:
+        for params in ParameterGrid(CANDIDATES[family][1]):
+            yield family, params
+
+
+def training_arrays(dataset, folds, cache_dir=None, seed=42):
+    # Features, target and fold assignment of the training rows (the registry's holdout is left out),
+    # cached per training fingerprint so repeated searches skip the extraction and the split
+    fingerprint = training_fingerprint(dataset)
+    path = os.path.join(cache_dir, f'{fingerprint}-k{folds}-s{seed}.npz') if cache_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as cached:
+            return cached['X'], cached['y'], cached['fold'], fingerprint
+
+    train = dataset[~holdout_mask(dataset)]
+    X = train[FEATURES].to_numpy(dtype=float)
+    y = train[TARGET].to_numpy(dtype=float)
+    fold = np.empty(len(X), dtype=np.int8)
+    for index, (_, test_index) in enumerate(KFold(folds, shuffle=True, random_state=seed).split(X)):
+        fold[test_index] = index
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, X=X, y=y, fold=fold)
+        os.replace(tmp_path, path)
+    return X, y, fold, fingerprint
+
+
+def _score_fold(family, params, X, y, fold, index):
+    estimator = CANDIDATES[family][0](**params)
+    test = fold == index
+    start = time.perf_counter()
+    estimator.fit(X[~test], y[~test])
+    seconds = time.perf_counter() - start
+    error = estimator.predict(X[test]) - y[test]
+    return family, params, index, float(np.mean(error ** 2)), seconds
+
+
+def search(dataset, folds=5, workers=-1, families=None, cache_dir=None):
+    # Every (candidate, fold) pair is one task, so candidates and folds run in parallel across the pool
+    start = time.perf_counter()
+    X, y, fold, fingerprint = training_arrays(dataset, folds, cache_dir)
+    prepared = time.perf_counter() - start
+    tasks = [(family, params, index) for family, params in candidates(families) for index in range(folds)]
+    scores = Parallel(n_jobs=workers)(delayed(_score_fold)(family, params, X, y, fold, index)
+                                      for family, params, index in tasks)
+
+    results = {}
+    for family, params, index, mse, seconds in scores:
+        result = results.setdefault(json.dumps([family, params], sort_keys=True),
+                                    {'family': family, 'params': params, 'fold_mse': [], 'fit_seconds': []})
+        result['fold_mse'].append(mse)
+        result['fit_seconds'].append(seconds)
+    for result in results.values():
+        result['mean_mse'] = float(np.mean(result['fold_mse']))
+        result['std_mse'] = float(np.std(result['fold_mse']))
+        result['mean_fit_seconds'] = float(np.mean(result['fit_seconds']))
+    ranked = sorted(results.values(), key=lambda result: result['mean_mse'])
+    return {'fingerprint': fingerprint, 'rows': int(len(X)), 'folds': folds, 'prepare_seconds': prepared,
+            'search_seconds': time.perf_counter() - start, 'candidates': ranked}
+
+
+def fit_best(dataset, best, fingerprint, moments):
+    # Refit the winner on every training row and score it on the registry's holdout. moments() gives the train
+    # and test moments the served model carries, which in chunked mode cover more rows than dataset.
+    train, test = moments()
+    family, params = best['family'], best['params']
+    if family in LINEAR_FAMILIES:
+        return linear_model(train, test, fingerprint, params.get('alpha', 0.0))
+
+    holdout = holdout_mask(dataset)
+    estimator = CANDIDATES[family][0](**params)
+    estimator.fit(dataset.loc[~holdout, FEATURES].to_numpy(dtype=float), dataset.loc[~holdout, TARGET])
+    error = estimator.predict(dataset.loc[holdout, FEATURES].to_numpy(dtype=float)) - dataset.loc[holdout, TARGET]
+    fitted = linear_model(train, test, fingerprint)
+    return fitted._replace(mse=float(np.mean(error ** 2)), estimator=estimator)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cross-validate sales regressors and publish the best one')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=-1, help='parallel fits; -1 uses every core')
+    parser.add_argument('--family', action='append', choices=sorted(CANDIDATES), help='limit the search')
+    parser.add_argument('--cache-dir', default=os.environ.get('MODEL_SEARCH_CACHE', '.model_search'))
+    parser.add_argument('--report', default='model_search_report.json')
+    parser.add_argument('--no-publish', action='store_true', help='only report, keep the served model')
+    args = parser.parse_args(argv)
+
+    from context import data
+    fingerprint, moments, dataset = data.training_set()
+    report = search(dataset, args.folds, args.workers, args.family, args.cache_dir)
+    best = report['candidates'][0]
+
+    start = time.perf_counter()
+    fitted = fit_best(dataset, best, fingerprint, moments)
+    report['best'] = {'family': best['family'], 'params': best['params'], 'cv_mse': best['mean_mse'],
+                      'holdout_mse': fitted.mse, 'fingerprint': fingerprint, 'refit_seconds': time.perf_counter() - start,
+                      'published': not args.no_publish}
+    if not args.no_publish:
+        # Running servers trained on the same data pick this up on their next prediction, since it carries the
+        # fingerprint they train under
+        SalesModelRegistry(data.model_path).publish(fitted)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    for result in report['candidates']:
+        print(f"{result['mean_mse']:14.6g} ± {result['std_mse']:<10.3g} {result['mean_fit_seconds']:8.3f}s  "
+              f"{result['family']} {json.dumps(result['params'], sort_keys=True)}")
+    print(f"best: {best['family']} {best['params']}, holdout MSE {fitted.mse:.6g}; "
+          f"{report['search_seconds']:.1f}s search, report in {args.report}")
+
+
+if __name__ == '__main__':
+    main()
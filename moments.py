@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class Moments:
+    # Row count, column means and centered scatter matrix (sum of outer products of deviations from the mean)
+    # of a block of numeric columns. Moments of disjoint row sets merge exactly, so they accumulate chunk by chunk.
+
+    def __init__(self, count, mean, scatter):
+        self.count = count
+        self.mean = mean
+        self.scatter = scatter
+
+    @classmethod
+    def empty(cls, width):
+        return cls(0, np.zeros(width), np.zeros((width, width)))
+
+    @classmethod
+    def of(cls, X):
+        X = np.asarray(X, dtype=float)
+        if not len(X):
+            return cls.empty(X.shape[1])
+        mean = X.mean(axis=0)
+        centered = X - mean
+        return cls(len(X), mean, centered.T @ centered)
+
+    def merge(self, other):
+        # Pairwise update of Chan, Golub and LeVeque; stable where raw sums of squares would cancel
+        if not other.count:
+            return self
+        if not self.count:
+            return other
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        mean = self.mean + delta * (other.count / count)
+        scatter = self.scatter + other.scatter + np.outer(delta, delta) * (self.count * other.count / count)
+        return Moments(count, mean, scatter)
+
+    @property
+    def covariance(self):
+        return self.scatter / max(self.count - 1, 1)
+
+    @property
+    def correlation(self):
+        scale = np.sqrt(np.diag(self.scatter))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.scatter / np.outer(scale, scale)
@@ -0,0 +1,81 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Shape of the cached values, part of every key: entries written in an older shape, e.g. in PLOT_CACHE_DIR by a
+# previous release, are never read back. 2 is the (image, alt) pair.
+SCHEMA_VERSION = 2
+
+
+class PlotCache:
+    def __init__(self, max_entries=64, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(visualization_type, fingerprint):
+        return f'{visualization_type}.v{SCHEMA_VERSION}-{fingerprint}'
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        cached = self._read(key)
+        if cached is not None:
+            self._remember(key, cached)
+        return cached
+
+    def put(self, key, value):
+        self._remember(key, value)
+        self._write(key, value)
+
+    def invalidate(self, keep_fingerprints=()):
+        # Drop every entry rendered from data that is no longer current, or stored in an older shape
+        keep = set(keep_fingerprints)
+
+        def stale(key):
+            prefix, _, fingerprint = key.rpartition('-')
+            return fingerprint not in keep or not prefix.endswith(f'.v{SCHEMA_VERSION}')
+
+        with self._lock:
+            for key in list(self._entries):
+                if stale(key):
+                    del self._entries[key]
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.cache') and stale(name[:-len('.cache')]):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.cache')
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _write(self, key, value):
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
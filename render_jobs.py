@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+
+
+class RenderJob:
+    def __init__(self, job_id, key, args):
+        self.id = job_id
+        self.key = key
+        self.args = args
+        self.future = Future()
+        self.source = None
+        self.stages = None
+
+    @property
+    def status(self):
+        if self.future.done():
+            return 'failed' if self.future.exception() is not None else 'done'
+        if self.source is not None and self.source.running():
+            return 'running'
+        return 'queued'
+
+    def error(self):
+        if self.future.done() and self.future.exception() is not None:
+            return str(self.future.exception())
+        return None
+
+
+class RenderJobs:
+    # Chart renders shared by every request for the same chart and data: the job id follows from the plot
+    # cache key, so identical requests arriving while a render is queued or running all wait on that one
+    # render, and finished renders land in the plot cache
+
+    def __init__(self, pool, cache, max_finished=64):
+        self._pool = pool
+        self._cache = cache
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def job_id(key):
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(self, key, *args):
+        job_id = self.job_id(key)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # A failed render is tried again by the next request for it
+            if job is not None and job.status != 'failed':
+                self._jobs.move_to_end(job_id)
+                return job
+            job = self._jobs[job_id] = RenderJob(job_id, key, args)
+            self._trim()
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            job.future.set_result(cached)
+            return job
+        try:
+            job.source = self._pool.submit(*args)
+        except BaseException as e:
+            job.future.set_exception(e)
+            raise
+        job.source.add_done_callback(partial(self._finished, job))
+        return job
+
+    def _finished(self, job, source):
+        if source.exception() is not None:
+            job.future.set_exception(source.exception())
+            return
+        rendered, job.stages = source.result()
+        self._cache.put(job.key, rendered)
+        job.future.set_result(rendered)
+
+    def clear(self):
+        # Drops finished jobs, so the next request for each chart renders or reads the plot cache again
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.future.done()]:
+                del self._jobs[job_id]
+
+    def _trim(self):
+        # Finished jobs are kept a while for clients still polling them; running ones are never dropped
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+class RenderPool:
+    def __init__(self, render, workers=None, max_queue=32, kind='thread', wait_timeout=10):
+        # render must be a module-level function so process workers can unpickle it
+        self._render = render
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(self.workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == 'process':
+                    # Forked workers share the parent's parsed dataset copy-on-write
+                    context = multiprocessing.get_context('fork')
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+            return self._executor
+
+    def submit(self, *args):
+        # Running plus queued renders are capped; callers past the cap wait, then give up
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise RenderQueueFull(f'More than {self.workers} renders running and the queue is full')
+        try:
+            future = self._get_executor().submit(self._render, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def restart(self):
+        # Process workers hold a snapshot of the data, so replace them after the dataset changes
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,125 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from context import InvalidFilters
+
+# Filter query parameter -> indexed dataset column
+DIMENSIONS = {
+    'branch': 'Branch',
+    'city': 'City',
+    'customer_type': 'Customer type',
+    'gender': 'Gender',
+    'product_line': 'Product line',
+    'payment': 'Payment',
+    'month': 'Month',
+}
+PARAMETERS = {column: param for param, column in DIMENSIONS.items()}
+# Inclusive bounds of the Date range filter, as YYYY-MM-DD; the filter is ('Date', (start, end)), '' where unbounded
+DATE_RANGE = ('start', 'end')
+
+
+def parse_filters(args, extra=None):
+    # Canonical, hashable form ((column, (value, ...)), ...), so equal filters share cache entries.
+    # Values within a dimension are alternatives; dimensions combine with AND. With extra, the names of the
+    # caller's other parameters, any other parameter is an error rather than silently ignored.
+    if extra is not None:
+        unknown = sorted(set(args) - set(DIMENSIONS) - set(DATE_RANGE) - set(extra))
+        if unknown:
+            raise InvalidFilters(f'Unknown parameters: {", ".join(unknown)}; filters are '
+                             f'{", ".join([*DIMENSIONS, *DATE_RANGE])}')
+    filters = []
+    for param, column in DIMENSIONS.items():
+        values = sorted({value for value in args.getlist(param) if value})
+        if values:
+            filters.append((column, tuple(values)))
+    start, end = (_date(args, param) for param in DATE_RANGE)
+    if start and end and start > end:
+        raise InvalidFilters('start must not be after end')
+    if start or end:
+        filters.append(('Date', (start, end)))
+    return tuple(filters)
+
+
+def _date(args, param):
+    value = args.get(param)
+    if not value:
+        return ''
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise InvalidFilters(f'{param} must be a date as YYYY-MM-DD')
+
+
+def filter_params(filters):
+    params = {}
+    for column, values in filters:
+        if column == 'Date':
+            params.update({param: value for param, value in zip(DATE_RANGE, values) if value})
+        else:
+            params[PARAMETERS[column]] = list(values)
+    return params
+
+
+class RowIndex:
+    # One packed bitmap per value of each dimension, so a combination of filters costs a few vectorized
+    # ORs and ANDs over N/8 bytes instead of comparing every row of the frame
+
+    def __init__(self, dataset, columns=tuple(DIMENSIONS.values())):
+        self.rows = len(dataset)
+        # Days since the epoch, which date ranges compare against
+        self.days = dataset['Date'].to_numpy(dtype='datetime64[D]').astype(np.int32)
+        self.bitmaps = {}
+        for column in columns:
+            codes, labels = pd.factorize(dataset[column], sort=True)
+            self.bitmaps[column] = {str(label): np.packbits(codes == code) for code, label in enumerate(labels)}
+
+    def options(self):
+        return {column: list(bitmaps) for column, bitmaps in self.bitmaps.items()}
+
+    def mask(self, filters):
+        result = None
+        for column, values in filters:
+            if column == 'Date':
+                matched = np.packbits(self._in_range(*values))
+            else:
+                bitmaps = self.bitmaps[column]
+                matched = np.zeros((self.rows + 7) // 8, dtype=np.uint8)
+                for value in values:
+                    if value in bitmaps:
+                        matched |= bitmaps[value]
+            if result is None:
+                result = matched
+            else:
+                result &= matched
+        return result
+
+    def _in_range(self, start, end):
+        selected = np.ones(self.rows, dtype=bool)
+        if start:
+            selected &= self.days >= np.datetime64(start, 'D').astype(np.int32)
+        if end:
+            selected &= self.days <= np.datetime64(end, 'D').astype(np.int32)
+        return selected
+
+    def positions(self, filters):
+        # Only bytes with a match are unpacked, so selective filters resolve without touching every row
+        mask = self.mask(filters)
+        nonzero = np.flatnonzero(mask)
+        bits = np.unpackbits(mask[nonzero]).reshape(-1, 8).astype(bool)
+        return (nonzero[:, None] * 8 + np.arange(8))[bits]
+
+    def count(self, filters):
+        # Bits counted in the packed bytes, without unpacking the mask to a byte per row
+        return _popcount(self.mask(filters)) if filters else self.rows
+
+
+# Set bits of every byte value, for NumPy releases without bitwise_count
+_BIT_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _popcount(packed):
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(packed).sum())
+    return int(_BIT_COUNTS[packed].sum())
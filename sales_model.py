@@ -0,0 +1,260 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from moments import Moments
+
+FEATURES = ['Unit price', 'Quantity', 'Tax 5%', 'gross income']
+TARGET = 'Total'
+
+# Field names used by the predict_sales form, accepted as aliases in batch input
+FEATURE_ALIASES = {'unit_price': 'Unit price', 'quantity': 'Quantity', 'tax_percent': 'Tax 5%',
+                   'gross_income': 'gross income'}
+
+BATCH_CHUNK_ROWS = 10000
+
+# One row in HOLDOUT_BUCKETS, picked by a hash of its values, is held out to score the model. A row lands on the
+# same side whether it is in the initial fit or a later batch, so incremental updates match a full refit.
+HOLDOUT_BUCKETS = 5
+
+# Below this singular value ratio a feature combination is treated as collinear (gross income is 5% tax exactly)
+RCOND = 1e-10
+
+# train and test are the Moments of FEATURES + [TARGET] over each split: the sufficient statistics of the fit.
+# alpha is the ridge penalty of the linear solution; estimator is set when model_search published a model
+# that is not linear, and then serves predictions instead of coef and intercept.
+FittedModel = namedtuple('FittedModel', ['coef', 'intercept', 'mse', 'fingerprint', 'train', 'test', 'alpha',
+                                         'estimator'], defaults=(0.0, None))
+
+
+def training_fingerprint(dataset):
+    # Only the columns the regressor sees matter, so other edits do not force a refit
+    hashed = pd.util.hash_pandas_object(dataset[FEATURES + [TARGET]], index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+
+def _frame_to_matrix(frame):
+    frame = frame.rename(columns=FEATURE_ALIASES)
+    missing = [feature for feature in FEATURES if feature not in frame.columns]
+    if missing:
+        raise ValueError(f'Missing columns: {", ".join(missing)}')
+    try:
+        X = frame[FEATURES].to_numpy(dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError('Feature values must be numeric')
+    return _checked(X)
+
+
+def _checked(X):
+    if X.ndim != 2 or X.shape[1] != len(FEATURES):
+        raise ValueError(f'Each row needs {len(FEATURES)} values: {", ".join(FEATURES)}')
+    if not np.isfinite(X).all():
+        raise ValueError('Feature values must be finite numbers')
+    return X
+
+
+def rows_to_matrix(rows):
+    # Accepts [[unit price, quantity, tax, gross income], ...] or a list of objects keyed by feature name
+    if not isinstance(rows, list):
+        raise ValueError('Expected a JSON array of rows')
+    if not rows:
+        return np.empty((0, len(FEATURES)))
+    if all(isinstance(row, dict) for row in rows):
+        return _frame_to_matrix(pd.DataFrame.from_records(rows))
+    try:
+        X = np.array(rows, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError('Rows must be arrays of numbers or objects keyed by feature name')
+    return _checked(X)
+
+
+def csv_to_matrices(stream, chunk_rows=BATCH_CHUNK_ROWS):
+    # Parse an uploaded CSV a chunk at a time so memory stays bounded by chunk_rows
+    with pd.read_csv(stream, chunksize=chunk_rows) as reader:
+        start = 0
+        for chunk in reader:
+            try:
+                X = _frame_to_matrix(chunk)
+            except ValueError as e:
+                raise ValueError(f'Rows {start + 1}-{start + len(chunk)}: {e}')
+            start += len(chunk)
+            yield X
+
+
+def holdout_mask(frame):
+    columns = frame[FEATURES + [TARGET]]
+    return pd.util.hash_pandas_object(columns, index=False).to_numpy() % HOLDOUT_BUCKETS == 0
+
+
+def split_moments(frame):
+    holdout = holdout_mask(frame)
+    values = frame[FEATURES + [TARGET]].to_numpy(dtype=float)
+    return Moments.of(values[~holdout]), Moments.of(values[holdout])
+
+
+def solve(train, alpha=0.0):
+    # Least squares with an intercept, solved on centered data like LinearRegression and Ridge do;
+    # without a penalty, collinear features get the minimum-norm solution
+    n = len(FEATURES)
+    gram = train.scatter[:n, :n] + alpha * np.eye(n)
+    coef = np.linalg.lstsq(gram, train.scatter[:n, n], rcond=RCOND)[0]
+    return coef, float(train.mean[n] - train.mean[:n] @ coef)
+
+
+def holdout_mse(test, coef, intercept):
+    # Mean squared residual over the held-out rows, computed from their moments alone
+    if not test.count:
+        return float('nan')
+    weights = np.append(-coef, 1.0)
+    bias = weights @ test.mean - intercept
+    # Clamped, since for a near-perfect fit rounding can leave the quadratic form slightly negative
+    return max(float(weights @ test.scatter @ weights / test.count + bias ** 2), 0.0)
+
+
+def linear_model(train, test, fingerprint, alpha=0.0):
+    coef, intercept = solve(train, alpha)
+    return FittedModel(coef, intercept, holdout_mse(test, coef, intercept), fingerprint, train, test, alpha)
+
+
+class SalesModelRegistry:
+    # The served model, shared through the file at path with other worker processes and model_search.
+    # _owned is the modification time of the file this process last wrote or adopted, _seen the last one it
+    # looked at.
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._current = None
+        self._owned = None
+        self._seen = None
+
+    @property
+    def current(self):
+        self._refresh()
+        if self._current is None:
+            raise RuntimeError('Sales model has not been trained yet')
+        return self._current
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            return None
+
+    def _refresh(self):
+        # A model published elsewhere for the data this one was trained on, e.g. by model_search, replaces it.
+        # One trained on other data, such as a worker's after a batch this process has yet to apply, is left alone.
+        mtime = self._mtime()
+        if mtime is None or mtime == self._seen:
+            return
+        with self._lock:
+            if mtime == self._seen:
+                return
+            self._seen = mtime
+            loaded = self._read(self.path)
+            if loaded is not None and self._current is not None and loaded.fingerprint == self._current.fingerprint:
+                self._current, self._owned = loaded, mtime
+
+    @property
+    def mse(self):
+        return self.current.mse
+
+    def ensure(self, dataset):
+        return self.ensure_fitted(training_fingerprint(dataset), lambda: split_moments(dataset))
+
+    def ensure_fitted(self, fingerprint, moments):
+        # Fit once per dataset version, reusing the on-disk model when it was trained on the same data.
+        # moments() gives the train and test Moments, and is only called when there is no such model.
+        with self._lock:
+            if self._current is not None and self._current.fingerprint == fingerprint:
+                return self._current
+            if self.path and os.path.exists(self.path):
+                mtime = self._mtime()
+                loaded = self._read(self.path)
+                if loaded is not None and loaded.fingerprint == fingerprint:
+                    self._current, self._owned, self._seen = loaded, mtime, mtime
+                    return loaded
+            return self._publish(linear_model(*moments(), fingerprint))
+
+    def retrain(self, dataset):
+        return self.refit(training_fingerprint(dataset), lambda: split_moments(dataset))
+
+    def refit(self, fingerprint, moments):
+        with self._lock:
+            return self._publish(linear_model(*moments(), fingerprint))
+
+    def update(self, new_rows):
+        # Fold new rows into the sufficient statistics and re-solve, without revisiting the rows already seen.
+        # The fingerprint is chained, so a restarted process refits once from the full dataset. A published
+        # non-linear estimator cannot absorb the rows: it keeps serving, with the statistics updated in memory,
+        # until model_search publishes again. The file is only written if no other process has published
+        # to it since this one last did.
+        train, test = split_moments(new_rows)
+        current = self.current
+        with self._lock:
+            fingerprint = hashlib.sha1(f'{current.fingerprint}+{training_fingerprint(new_rows)}'.encode())
+            fitted = linear_model(current.train.merge(train), current.test.merge(test), fingerprint.hexdigest(),
+                                  current.alpha)
+            if current.estimator is not None:
+                self._current = fitted._replace(mse=current.mse, estimator=current.estimator)
+                return self._current
+            return self._publish(fitted, overwrite=False)
+
+    def publish(self, fitted):
+        with self._lock:
+            return self._publish(fitted)
+
+    def _publish(self, fitted, overwrite=True):
+        self._current = fitted
+        if self.path and (overwrite or self._mtime() in (None, self._owned)):
+            self._write(self.path, fitted)
+            self._owned = self._seen = self._mtime()
+        return fitted
+
+    def predict(self, rows):
+        # A linear model is just a dot product, applied to the whole batch at once
+        fitted = self.current
+        X = np.asarray(rows, dtype=float).reshape(-1, len(FEATURES))
+        if fitted.estimator is not None:
+            return fitted.estimator.predict(X)
+        return X @ fitted.coef + fitted.intercept
+
+    def predict_chunks(self, matrices, chunk_rows=BATCH_CHUNK_ROWS):
+        # Score each matrix in slices of chunk_rows, one vectorized call per slice
+        for X in matrices:
+            for start in range(0, len(X), chunk_rows):
+                yield self.predict(X[start:start + chunk_rows])
+
+    def save(self, path=None):
+        self._write(path or self.path, self.current)
+
+    def load(self, path=None):
+        loaded = self._read(path or self.path)
+        if loaded is None:
+            raise ValueError(f'No usable sales model in {path or self.path}')
+        with self._lock:
+            self._current = loaded
+            if path in (None, self.path):
+                self._owned = self._seen = self._mtime()
+        return loaded
+
+    @staticmethod
+    def _write(path, fitted):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(fitted._asdict(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+            return FittedModel(**payload)
+        except (OSError, pickle.UnpicklingError, TypeError, EOFError, AttributeError):
+            return None
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+from aggregates import GROUPINGS, MEASURES, SQUARES, AggregateCube
+from datastore import CATEGORY_COLUMNS, SOURCE_COLUMNS, apply_schema, dataset_fingerprint, file_sha1, prepare_dataset
+from row_index import DIMENSIONS
+
+# Every filter dimension is indexed, so filters and the filter options resolve through index lookups
+INDEXED_COLUMNS = ['Date'] + list(DIMENSIONS.values())
+TABLE_COLUMNS = SOURCE_COLUMNS + ['Month', 'batch']
+LOAD_CHUNK_ROWS = 100000
+
+# Consistent view of the store: its version, the last batch included and the cube over those rows
+StoreSnapshot = namedtuple('StoreSnapshot', ['version', 'seq', 'cube'])
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_type(column):
+    if column in ('Quantity',):
+        return 'INTEGER'
+    if column in CATEGORY_COLUMNS or column in ('Invoice ID', 'Date', 'Time'):
+        return 'TEXT'
+    return 'REAL'
+
+
+def _table_rows(frame, batch):
+    # Dates as ISO text, so the Date index serves range filters, plus the month the charts group by
+    rows = pd.DataFrame({column: frame[column].astype(str) if column in CATEGORY_COLUMNS else frame[column]
+                         for column in SOURCE_COLUMNS})
+    rows['Date'] = frame['Date'].dt.strftime('%Y-%m-%d')
+    rows['Time'] = (pd.Timestamp(0) + frame['Time']).dt.strftime('%H:%M:%S')
+    rows['Month'] = frame['Date'].dt.strftime('%Y-%m')
+    rows['batch'] = batch
+    return rows
+
+
+def _conditions(filters, upto=None):
+    conditions = []
+    for column, values in filters:
+        if column == 'Date':
+            # ISO dates compare as text, so the range is a scan of the Date index
+            start, end = values
+            conditions += [(f'Date {operator} ?', [bound]) for operator, bound in (('>=', start), ('<=', end)) if bound]
+        else:
+            conditions.append((f'{_quote(column)} IN ({", ".join("?" * len(values))})', list(values)))
+    if upto is not None:
+        conditions.append(('batch <= ?', [upto]))
+    return conditions
+
+
+def _where(conditions):
+    where = ' AND '.join(condition for condition, _ in conditions)
+    return f' WHERE {where}' if where else '', [param for _, values in conditions for param in values]
+
+
+def _prepared(raw):
+    raw = raw.reset_index(drop=True)
+    raw['Date'] = pd.to_datetime(raw['Date'], format='%Y-%m-%d')
+    return prepare_dataset(apply_schema(raw))
+
+
+class SalesStore:
+    # The sales rows in one SQLite file shared by every worker process. Aggregations run as SQL, filters on
+    # the indexed columns resolve through index lookups, and appended batches are tagged with a sequence
+    # number, so each process can fold in exactly the batches it has not seen yet.
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections belong to one thread and must not cross a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self, mode='DEFERRED'):
+        connection = self._connection()
+        connection.execute(f'BEGIN {mode}')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _last_batch(self, connection):
+        return connection.execute('SELECT seq, version FROM batches ORDER BY seq DESC LIMIT 1').fetchone()
+
+    def _meta(self, connection, key):
+        row = connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def ensure(self, csv_path):
+        # Built from the CSV once and reused while the CSV is unchanged; preload in a pre-fork master so
+        # the workers find it ready
+        source = file_sha1(csv_path)
+        if os.path.exists(self.path):
+            try:
+                with self._transaction() as connection:
+                    current = self._meta(connection, 'source') == source
+                if current:
+                    # A store built before a dimension was indexed gets the missing indexes
+                    with self._transaction('IMMEDIATE') as connection:
+                        self._create_indexes(connection)
+                    return self
+            except sqlite3.DatabaseError:
+                pass
+        self._build(csv_path, source)
+        return self
+
+    def _build(self, csv_path, source):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE batches (seq INTEGER PRIMARY KEY, fingerprint TEXT UNIQUE, version TEXT)')
+            definitions = ', '.join(f'{_quote(column)} {_column_type(column)}' for column in TABLE_COLUMNS)
+            connection.execute(f'CREATE TABLE sales ({definitions})')
+            for chunk in pd.read_csv(csv_path, chunksize=LOAD_CHUNK_ROWS):
+                _table_rows(apply_schema(chunk), 0).to_sql('sales', connection, if_exists='append', index=False)
+            self._create_indexes(connection)
+            version = hashlib.sha1(f'sqlite|{source}'.encode()).hexdigest()
+            connection.execute("INSERT INTO meta VALUES ('source', ?)", (source,))
+            connection.execute('INSERT INTO batches VALUES (0, NULL, ?)', (version,))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, self.path)
+        self._local = threading.local()
+
+    def _create_indexes(self, connection):
+        for column in INDEXED_COLUMNS + ['batch']:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {_quote("sales_" + column)} ON sales ({_quote(column)})')
+
+    def snapshot(self, groupings=GROUPINGS):
+        with self._transaction() as connection:
+            seq, version = self._last_batch(connection)
+            return StoreSnapshot(version, seq, self._cube(connection, groupings, [('batch <= ?', [seq])]))
+
+    def latest(self):
+        return self._connection().execute('SELECT MAX(seq) FROM batches').fetchone()[0]
+
+    def cube(self, groupings=GROUPINGS, filters=(), upto=None):
+        # filters in row_index.parse_filters form; every dimension is a stored column, Month as 'YYYY-MM' text
+        with self._transaction() as connection:
+            return self._cube(connection, groupings, _conditions(filters, upto))
+
+    def options(self):
+        # Values of each filter dimension, read from the column indexes
+        with self._transaction() as connection:
+            return {column: [row[0] for row in connection.execute(
+                        f'SELECT DISTINCT {_quote(column)} FROM sales ORDER BY 1')]
+                    for column in DIMENSIONS.values()}
+
+    def count(self, filters=(), upto=None):
+        where, params = _where(_conditions(filters, upto))
+        return self._connection().execute(f'SELECT COUNT(*) FROM sales{where}', params).fetchone()[0]
+
+    def _cube(self, connection, groupings, conditions):
+        # The same tables as aggregates.build_cube, summed by SQLite instead of pandas
+        where, params = _where(conditions)
+        measures = ', '.join(f'SUM({_quote(m)}) AS {_quote(m)}, SUM({_quote(m)} * {_quote(m)}) AS {_quote(SQUARES[m])}'
+                             for m in MEASURES)
+        tables = {}
+        for keys in groupings:
+            by = ', '.join(map(_quote, keys))
+            table = pd.read_sql_query(f'SELECT {by}, {measures}, COUNT(*) AS count FROM sales{where} '
+                                      f'GROUP BY {by} ORDER BY {by}', connection, params=params)
+            levels = []
+            for key in keys:
+                if key == 'Month':
+                    levels.append(pd.PeriodIndex(table[key], freq='M', name=key))
+                else:
+                    categories = [row[0] for row in connection.execute(
+                        f'SELECT DISTINCT {_quote(key)} FROM sales ORDER BY 1')]
+                    levels.append(pd.CategoricalIndex(table[key], categories=categories, name=key))
+            index = levels[0] if len(levels) == 1 else pd.MultiIndex.from_arrays(levels)
+            table = table.drop(columns=list(keys)).set_axis(index)
+            tables[keys] = table.astype({SQUARES[m]: float for m in MEASURES})
+        return AggregateCube(tables)
+
+    def rows(self, after=-1, upto=None, filters=()):
+        # Prepared rows of the batches after one sequence number and up to another, like datastore.load_sales
+        return _prepared(self._select([('batch > ?', [after])] + _conditions(filters, upto)))
+
+    def chunks(self, upto=None, filters=(), chunk_rows=LOAD_CHUNK_ROWS):
+        # The same rows a chunk at a time, so memory stays bounded by chunk_rows. Pages follow the rowid
+        # rather than one long read, so no transaction is held between chunks; the rows up to a batch never
+        # change, so the pages still add up to one consistent set.
+        last = 0
+        while True:
+            raw = self._select([('rowid > ?', [last])] + _conditions(filters, upto), chunk_rows)
+            if raw.empty:
+                return
+            last = int(raw.index[-1])
+            yield _prepared(raw)
+
+    def _select(self, conditions, limit=None):
+        where, params = _where(conditions)
+        limit = f' LIMIT {int(limit)}' if limit is not None else ''
+        with self._transaction() as connection:
+            return pd.read_sql_query(f'SELECT rowid, {", ".join(map(_quote, SOURCE_COLUMNS))} FROM sales{where} '
+                                     f'ORDER BY rowid{limit}', connection, params=params,
+                                     index_col='rowid')
+
+    def batch_version(self, seq):
+        row = self._connection().execute('SELECT version FROM batches WHERE seq = ?', (seq,)).fetchone()
+        return row[0] if row else None
+
+    def append(self, prepared, chain):
+        # One batch per transaction, skipped if it is already stored, e.g. uploaded twice; chain(version, rows)
+        # gives the version after it
+        fingerprint = dataset_fingerprint(prepared[SOURCE_COLUMNS])
+        with self._transaction('IMMEDIATE') as connection:
+            if connection.execute('SELECT 1 FROM batches WHERE fingerprint = ?', (fingerprint,)).fetchone():
+                return False
+            seq, version = self._last_batch(connection)
+            version = chain(version, prepared)
+            connection.execute('INSERT INTO batches VALUES (?, ?, ?)', (seq + 1, fingerprint, version))
+            # Not DataFrame.to_sql, which commits on its own in the middle of this transaction
+            rows = _table_rows(prepared, seq + 1)
+            connection.executemany(f'INSERT INTO sales ({", ".join(map(_quote, TABLE_COLUMNS))}) '
+                                   f'VALUES ({", ".join("?" * len(TABLE_COLUMNS))})',
+                                   zip(*(rows[column].tolist() for column in TABLE_COLUMNS)))
+        return True
@@ -0,0 +1,50 @@
+import gzip
+import zlib
+
+import pytest
+
+from compression import MIN_SIZE, CompressedCache, compress_stream
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.mark.parametrize('path', ['/api/aggregates/correlation_heatmap', '/plot/revenue.svg'])
+def test_each_encoding_has_its_own_etag(client, path):
+    identity = client.get(path)
+    compressed = client.get(path, headers=GZIP)
+    assert len(identity.data) >= MIN_SIZE
+    assert 'Content-Encoding' not in identity.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] == identity.headers['ETag'][:-1] + '-gzip"'
+    assert gzip.decompress(compressed.data) == identity.data
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+
+    assert client.get(path, headers={**GZIP, 'If-None-Match': compressed.headers['ETag']}).status_code == 304
+    assert client.get(path, headers={'If-None-Match': identity.headers['ETag']}).status_code == 304
+    # The gzip tag does not validate the identity body
+    assert client.get(path, headers={'If-None-Match': compressed.headers['ETag']}).status_code == 200
+
+
+def test_streamed_bodies_are_compressed_per_chunk(client):
+    identity = client.get('/view_dataset.ndjson')
+    compressed = client.get('/view_dataset.ndjson', headers=GZIP)
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in compressed.headers
+    assert gzip.decompress(compressed.data) == identity.data
+
+
+def test_compress_stream_flushes_each_chunk():
+    decompressor = zlib.decompressobj(31)
+    chunks = compress_stream(iter(['first ', b'second', '']), 'gzip')
+    assert decompressor.decompress(next(chunks)) == b'first '
+    assert decompressor.decompress(next(chunks)) == b'second'
+    assert decompressor.decompress(b''.join(chunks)) == b''
+    assert decompressor.eof
+
+
+def test_cache_skips_bodies_larger_than_itself():
+    cache = CompressedCache(max_bytes=4 * MIN_SIZE)
+    cache.put('a', 'text/plain', b'a' * MIN_SIZE)
+    cache.put('big', 'text/plain', b'b' * 5 * MIN_SIZE)
+    assert cache.get('big') is None
+    assert cache.get('a', 'gzip')[2] == 'gzip'
@@ -0,0 +1,15 @@
+from conftest import NEW_PRODUCT_LINE, assert_moments_equal
+from correlations import SEGMENTS, correlation_moments
+from datastore import append_rows
+
+
+def test_correlation_moments_merge(batches):
+    old, new = batches
+    merged = correlation_moments(old).merge(correlation_moments(new))
+    expected = correlation_moments(append_rows(old, new))
+    assert_moments_equal(merged.overall, expected.overall)
+    for column in SEGMENTS:
+        assert set(merged.segments[column]) == set(expected.segments[column])
+        for value, moments in expected.segments[column].items():
+            assert_moments_equal(merged.moments(column, value), moments)
+    assert NEW_PRODUCT_LINE in merged.segments['Product line']
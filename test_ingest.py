@@ -0,0 +1,65 @@
+import io
+
+import pytest
+
+from aggregates import build_cube
+from benchmark import synthetic_sales
+from conftest import NEW_PRODUCT_LINE, assert_cubes_equal, csv_upload
+from datastore import append_rows, validate_rows
+
+
+def test_cube_merge_matches_cube_of_all_rows(batches):
+    old, new = batches
+    merged = build_cube(old).merge(build_cube(new))
+    assert_cubes_equal(merged, build_cube(append_rows(old, new)))
+    assert merged.count('Product line')[NEW_PRODUCT_LINE] == (new['Product line'] == NEW_PRODUCT_LINE).sum()
+
+
+def test_ingest_appends_batch(client):
+    import app
+    version = app.data.version
+    response = client.post('/ingest', data=csv_upload(synthetic_sales(20, seed=5)))
+    assert response.status_code == 200
+    assert response.json['appended'] == 20
+    assert response.json['rows'] == 520
+    assert response.json['version'] != version
+
+
+def test_ingest_requires_a_file(client):
+    assert client.post('/ingest').status_code == 400
+
+
+@pytest.mark.parametrize('column, value', [
+    ('Quantity', 40000),
+    ('Quantity', 2.5),
+    ('Quantity', 'many'),
+    ('Unit price', 'cheap'),
+    ('Branch', None),
+])
+def test_ingest_rejects_invalid_rows(client, column, value):
+    import app
+    raw = synthetic_sales(5, seed=6).astype({column: object})
+    raw.loc[2, column] = value
+    response = client.post('/ingest', data=csv_upload(raw))
+    assert response.status_code == 400, response.json
+    assert len(app.data.dataset) == 500
+
+
+def test_ingest_rejects_missing_columns(client):
+    response = client.post('/ingest', data=csv_upload(synthetic_sales(5).drop(columns=['Rating'])))
+    assert response.status_code == 400
+    assert 'Rating' in response.json['error']
+
+
+def test_ingest_rejects_empty_upload(client):
+    response = client.post('/ingest', data={'file': (io.BytesIO(b''), 'batch.csv')})
+    assert response.status_code == 400
+
+
+def test_validate_rows_keeps_quantity_in_range():
+    raw = synthetic_sales(3)
+    raw.loc[0, 'Quantity'] = 32767
+    assert validate_rows(raw)['Quantity'].tolist()[0] == 32767
+    raw.loc[0, 'Quantity'] = 32768
+    with pytest.raises(ValueError, match='Quantity'):
+        validate_rows(raw)
@@ -0,0 +1,63 @@
+import io
+import json
+
+import pytest
+
+import app
+from benchmark import synthetic_sales
+from conftest import csv_upload
+from sales_model import FEATURES
+
+
+@pytest.fixture
+def baskets():
+    return synthetic_sales(50, seed=3)[FEATURES]
+
+
+def test_csv_upload_streams_one_prediction_per_row(client, baskets):
+    response = client.post('/predict_sales/batch', data=csv_upload(baskets))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    predictions = response.get_data(as_text=True).splitlines()[1:]
+    assert len(predictions) == len(baskets)
+    expected = app.data.sales_model.predict(baskets.to_numpy())
+    assert [float(line.split(',')[1]) for line in predictions] == pytest.approx(expected.tolist())
+
+
+def test_json_rows_by_name_or_position(client, baskets):
+    # Each streamed body is read before the next request, as a server would
+    by_name = client.post('/predict_sales/batch', json=baskets.head(3).to_dict('records')).get_data(as_text=True)
+    by_position = client.post('/predict_sales/batch', json={'rows': baskets.head(3).to_numpy().tolist()})
+    assert by_position.status_code == 200
+    assert by_position.get_data(as_text=True) == by_name
+    assert len([json.loads(line) for line in by_name.splitlines()]) == 3
+
+
+@pytest.mark.parametrize('rows', [
+    {'rows': 'not a list'},
+    [[1.0, 2.0]],
+    [[1.0, 2.0, 3.0, 'x']],
+    [[1.0, 2.0, 3.0, float('inf')]],
+    [{'unit_price': 1.0}],
+])
+def test_invalid_json_rows(client, rows):
+    response = client.post('/predict_sales/batch', data=json.dumps(rows), content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_bad_row_anywhere_in_upload_is_a_400(client):
+    baskets = synthetic_sales(25000, seed=4)[FEATURES].astype({'Quantity': object})
+    baskets.loc[24000, 'Quantity'] = 'many'
+    response = client.post('/predict_sales/batch', data=csv_upload(baskets))
+    assert response.status_code == 400
+    assert 'Rows 20001-25000' in response.json['error']
+
+
+def test_format_is_checked_before_the_upload_is_parsed(client, monkeypatch):
+    def unexpected(storage):
+        raise AssertionError('upload parsed')
+    monkeypatch.setattr(app, '_spooled_upload', unexpected)
+    response = client.post('/predict_sales/batch?format=xml', data={'file': (io.BytesIO(b'x'), 'b.csv')})
+    assert response.status_code == 400
+    assert 'xml' in response.json['error']
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import row_index
+from benchmark import synthetic_sales
+from conftest import prepared
+from context import InvalidFilters
+from row_index import RowIndex, filter_params, parse_filters
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    return prepared(synthetic_sales(3001, seed=7))
+
+
+def test_parse_filters_is_canonical():
+    args = MultiDict([('product_line', 'Fashion accessories'), ('branch', 'B'), ('branch', 'A'), ('branch', 'B'),
+                      ('gender', ''), ('end', '2019-02-28')])
+    filters = parse_filters(args)
+    assert filters == (('Branch', ('A', 'B')), ('Product line', ('Fashion accessories',)),
+                       ('Date', ('', '2019-02-28')))
+    assert parse_filters(MultiDict(filter_params(filters))) == filters
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'gender': 'Male', 'colour': 'red'}, 'colour'),
+    ({'start': '2019-13-01'}, 'start'),
+    ({'start': '2019-03-01', 'end': '2019-02-01'}, 'start must not be after end'),
+])
+def test_parse_filters_rejects(args, message):
+    with pytest.raises(InvalidFilters, match=message):
+        parse_filters(MultiDict(args), extra=('format',))
+
+
+@pytest.mark.parametrize('filters', [
+    (('Branch', ('A',)),),
+    (('Branch', ('A', 'C')), ('Gender', ('Female',))),
+    (('Product line', ('Food and beverages',)), ('Month', ('2019-02',))),
+    (('Date', ('2019-01-10', '2019-02-05')), ('Payment', ('Cash', 'Ewallet'))),
+    (('Date', ('2019-03-01', '')),),
+    (('City', ('Nowhere',)),),
+])
+def test_positions_and_count_match_pandas(dataset, filters):
+    expected = np.ones(len(dataset), dtype=bool)
+    for column, values in filters:
+        if column == 'Date':
+            start, end = values
+            expected &= (dataset['Date'] >= (start or '1900-01-01')) & (dataset['Date'] <= (end or '2100-01-01'))
+        else:
+            expected &= dataset[column].astype(str).isin(values).to_numpy()
+    index = RowIndex(dataset)
+    np.testing.assert_array_equal(index.positions(filters), np.flatnonzero(expected))
+    assert index.count(filters) == expected.sum()
+
+
+def test_popcount_without_bitwise_count(dataset, monkeypatch):
+    index = RowIndex(dataset)
+    filters = (('Gender', ('Male',)),)
+    expected = index.count(filters)
+    monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    assert row_index._popcount(index.mask(filters)) == expected
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from conftest import assert_moments_equal
+from datastore import append_rows
+from moments import Moments
+from sales_model import SalesModelRegistry, linear_model, split_moments
+
+
+def test_moments_merge_matches_moments_of_all_rows():
+    # Far from zero, where raw sums of squares would cancel
+    X = np.random.default_rng(0).normal(1e6, 3.0, (1000, 4))
+    merged = Moments.empty(4)
+    for chunk in np.array_split(X, [0, 1, 250, 251, 700]):
+        merged = merged.merge(Moments.of(chunk))
+    assert_moments_equal(merged, Moments.of(X))
+
+
+def test_incremental_fit_matches_refit(batches):
+    old, new = batches
+    registry = SalesModelRegistry()
+    registry.ensure(old)
+    updated = registry.update(new)
+    refit = linear_model(*split_moments(append_rows(old, new)), None)
+    np.testing.assert_allclose(updated.coef, refit.coef, rtol=1e-6, atol=1e-8)
+    assert updated.intercept == pytest.approx(refit.intercept, abs=1e-6)
+    assert updated.mse == pytest.approx(refit.mse, rel=1e-6, abs=1e-9)
+    assert updated.train.count + updated.test.count == len(old) + len(new)
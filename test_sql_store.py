@@ -0,0 +1,44 @@
+import pytest
+
+from aggregates import build_cube
+from conftest import assert_cubes_equal, assert_moments_equal
+from correlations import correlation_moments
+from datastore import append_rows, chained_fingerprint
+from sql_store import SalesStore
+
+
+@pytest.fixture
+def store(raw_batches, tmp_path):
+    csv_path = tmp_path / 'sales.csv'
+    raw_batches[0].to_csv(csv_path, index=False)
+    return SalesStore(str(tmp_path / 'sales.sqlite')).ensure(str(csv_path))
+
+
+def test_cube_matches_build_cube(store, batches):
+    old, new = batches
+    assert_cubes_equal(store.cube(), build_cube(old))
+    assert store.append(new, chained_fingerprint)
+    assert not store.append(new, chained_fingerprint)
+    assert_cubes_equal(store.snapshot().cube, build_cube(append_rows(old, new)))
+
+
+def test_filters_push_down(store, batches):
+    old = batches[0]
+    filters = (('Gender', ('Female',)), ('Month', ('2019-02',)), ('Date', ('2019-02-03', '2019-02-20')))
+    selected = old[(old['Gender'] == 'Female') & (old['Date'] >= '2019-02-03') & (old['Date'] <= '2019-02-20')]
+    assert store.count(filters) == len(selected)
+    assert_cubes_equal(store.cube(filters=filters), build_cube(selected))
+    assert store.options()['Branch'] == ['A', 'B', 'C']
+
+
+def test_chunks_cover_every_row_once(store, batches):
+    old, new = batches
+    store.append(new, chained_fingerprint)
+    seq = store.snapshot().seq
+    chunks = list(store.chunks(upto=seq, chunk_rows=128))
+    assert [len(chunk) for chunk in chunks][:-1] == [128] * (len(chunks) - 1)
+    merged = correlation_moments(chunks[0])
+    for chunk in chunks[1:]:
+        merged = merged.merge(correlation_moments(chunk))
+    assert_moments_equal(merged.overall, correlation_moments(append_rows(old, new)).overall)
+    assert sum(map(len, store.chunks(upto=0))) == len(old)